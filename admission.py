@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+# Priority classes, most important first
+PRIORITY_REDIRECT = 0
+PRIORITY_WRITE = 1
+PRIORITY_DASHBOARD = 2
+
+PRIORITY_NAMES = {
+    PRIORITY_REDIRECT: 'redirect',
+    PRIORITY_WRITE: 'write',
+    PRIORITY_DASHBOARD: 'dashboard'
+}
+
+# Fraction of the concurrency limit each priority class may fill; lower
+# priorities are shed first and always leave headroom for redirects
+PRIORITY_SHARES = {
+    PRIORITY_REDIRECT: 1.0,
+    PRIORITY_WRITE: 0.75,
+    PRIORITY_DASHBOARD: 0.5
+}
+
+INITIAL_LIMIT = int(os.environ.get('SHORTENER_CONCURRENCY_LIMIT', '32'))
+MIN_LIMIT = 4
+MAX_LIMIT = int(os.environ.get('SHORTENER_MAX_CONCURRENCY', '256'))
+
+# Latency may rise this far above its long-run baseline before the limit shrinks
+LATENCY_TOLERANCE = 2.0
+DECREASE_FACTOR = 0.9
+
+# Minimum seconds between two multiplicative decreases
+DECREASE_COOLDOWN = 0.25
+
+
+def request_priority(path):
+    """Classify a request path into a priority class"""
+    if path.startswith('/r/'):
+        return PRIORITY_REDIRECT
+    if path.startswith('/internal/'):
+        # Clicks reported by redirect workers
+        return PRIORITY_WRITE
+    action = path.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+    if path.startswith('/api/') and action in ('shorten', 'delete', 'batch', 'destinations', 'available'):
+        return PRIORITY_WRITE
+    return PRIORITY_DASHBOARD
+
+
+class AdmissionController:
+    """Server-wide adaptive concurrency limit with prioritized load shedding.
+
+    The limit follows AIMD driven by the latency gradient of redirects: it
+    grows by about one per limit's worth of redirects that complete near
+    the baseline latency, and shrinks by DECREASE_FACTOR when their
+    short-term average latency rises past LATENCY_TOLERANCE times the
+    long-term one. Each priority class may only fill its share of the
+    limit, so dashboard calls get rejected well before redirects do.
+    """
+
+    def __init__(self, limit=INITIAL_LIMIT, min_limit=MIN_LIMIT, max_limit=MAX_LIMIT):
+        self.lock = threading.Lock()
+        self.limit = float(limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.inflight = 0
+        self.baseline_latency = None
+        self.recent_latency = None
+        self.last_decrease = 0.0
+        self.admitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.rejected = {priority: 0 for priority in PRIORITY_NAMES}
+
+    def try_acquire(self, priority):
+        """Admit a request, returning its start time, or None to shed it"""
+        with self.lock:
+            if self.inflight >= max(self.limit * PRIORITY_SHARES[priority], 1):
+                self.rejected[priority] += 1
+                return None
+            self.inflight += 1
+            self.admitted[priority] += 1
+        return time.perf_counter()
+
+    def release(self, started, priority):
+        """Finish an admitted request, feeding a redirect's latency into the limit"""
+        latency = time.perf_counter() - started
+        with self.lock:
+            self.inflight -= 1
+
+            # Dashboard and write calls are slow by nature; mixing them in would
+            # make a burst of /api/list calls look like an overloaded server
+            if priority != PRIORITY_REDIRECT:
+                return
+
+            if self.baseline_latency is None:
+                self.baseline_latency = self.recent_latency = latency
+                return
+            self.baseline_latency += (latency - self.baseline_latency) * 0.01
+            self.recent_latency += (latency - self.recent_latency) * 0.2
+
+            now = time.monotonic()
+            if self.recent_latency > self.baseline_latency * LATENCY_TOLERANCE:
+                if now - self.last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def get_metrics(self):
+        """Current limit, in-flight count, redirect latencies and per-class admissions"""
+        with self.lock:
+            return {
+                'limit': round(self.limit, 2),
+                'inflight': self.inflight,
+                'baseline_latency_ms': (self.baseline_latency or 0) * 1000,
+                'recent_latency_ms': (self.recent_latency or 0) * 1000,
+                'admitted': {PRIORITY_NAMES[p]: n for p, n in self.admitted.items()},
+                'rejected': {PRIORITY_NAMES[p]: n for p, n in self.rejected.items()}
+            }
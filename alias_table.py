@@ -0,0 +1,44 @@
+import math
+import random
+
+
+class AliasTable:
+    """Walker/Vose alias table for O(1) weighted random choice.
+
+    Built once per set of weights in O(n); every pick then costs one
+    random number, one multiply and one table lookup regardless of how
+    many choices there are.
+    """
+
+    def __init__(self, weights):
+        if not weights or any(not (weight > 0 and math.isfinite(weight)) for weight in weights):
+            raise ValueError("Weights must be a non-empty list of positive, finite numbers")
+
+        n = len(weights)
+        total = float(sum(weights))
+        if not math.isfinite(total):
+            raise ValueError("Weights are too large to add up")
+        scaled = [weight * n / total for weight in weights]
+        self.size = n
+        self.probability = [1.0] * n
+        self.alias = list(range(n))
+
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
+            else:
+                large.append(more)
+        # Whatever is left over is 1.0 up to rounding error
+
+    def pick(self, rng=random.random):
+        """Pick an index with probability proportional to its weight"""
+        u = rng() * self.size
+        i = int(u)
+        return i if u - i < self.probability[i] else self.alias[i]
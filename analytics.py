@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import sys
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+from click_archive import ClickArchive, archive_dir_for
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Clicks are bucketed by wall-clock time as recorded (naive ISO timestamps)
+EPOCH = datetime(1970, 1, 1)
+
+DIMENSIONS = ('code', 'os', 'browser', 'type')
+
+BUCKETS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400
+}
+
+
+def to_seconds(timestamp):
+    """Convert an ISO timestamp to seconds since EPOCH.
+
+    Timestamps with a UTC offset are converted to local time first, to
+    match the naive local timestamps clicks are recorded with.
+    """
+    moment = datetime.fromisoformat(timestamp)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return (moment - EPOCH).total_seconds()
+
+
+def from_seconds(seconds):
+    return (EPOCH + timedelta(seconds=seconds)).isoformat()
+
+
+class ClickColumns:
+    """Columnar copy of every click, for fast group-by and time-bucket queries.
+
+    Each click is one row across parallel arrays: timestamp in seconds,
+    link id and small integer codes for the device os, browser and type.
+    String values are interned in per-column dictionaries. New clicks are
+    appended as they happen; deleted links are masked out at query time.
+    URLShortener.build_analytics fills a live store's columns while it
+    keeps serving; codes in pending don't take live clicks yet because
+    their hot clicks are still to be read.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timestamps = array('d')
+        self.columns = {
+            'code': array('I'),
+            'os': array('H'),
+            'browser': array('H'),
+            'type': array('H')
+        }
+        self.values = {dimension: [] for dimension in DIMENSIONS}
+        self.value_ids = {dimension: {} for dimension in DIMENSIONS}
+        self.deleted = set()
+        self.pending = set()
+
+    @classmethod
+    def from_files(cls, filename):
+        """Build columns straight from a store file and its cold archive"""
+        urls = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                urls = json.load(f)
+        columns = cls()
+        columns.load(urls, ClickArchive(archive_dir_for(filename)))
+        return columns
+
+    def load(self, urls, archive):
+        segments, watermarks = archive.view()
+        for code, click in archive.iter_clicks(segments=segments):
+            data = urls.get(code)
+            if data is not None and click['timestamp'] >= data['created_at']:
+                self.add_click(code, click)
+        for code, data in urls.items():
+            if isinstance(data['clicks'], list):
+                # Hot clicks at or before the watermark were read from the archive
+                watermark = watermarks.get(code, '')
+                for click in data['clicks']:
+                    if click['timestamp'] > watermark:
+                        self.add_click(code, click)
+
+    def value_id(self, dimension, value):
+        ids = self.value_ids[dimension]
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(self.values[dimension])
+            self.values[dimension].append(value)
+        return value_id
+
+    def add_click(self, code, click):
+        """Append one click record as a row"""
+        device = click.get('device') or {}
+        with self.lock:
+            self.timestamps.append(to_seconds(click['timestamp']))
+            self.columns['code'].append(self.value_id('code', code))
+            for dimension in ('os', 'browser', 'type'):
+                self.columns[dimension].append(self.value_id(dimension, device.get(dimension, 'Unknown')))
+
+    def add_live_click(self, code, click):
+        """Append a click as it happens, unless its link's hot clicks are still to be read"""
+        if code not in self.pending:
+            self.add_click(code, click)
+
+    def delete_link(self, code):
+        """Hide a deleted link's clicks; a reused code gets a fresh link id"""
+        with self.lock:
+            link_id = self.value_ids['code'].pop(code, None)
+            if link_id is not None:
+                self.deleted.add(link_id)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def query(self, since=None, until=None, bucket=None, group_by=(), filters=None):
+        """Count clicks, optionally per time bucket and per group.
+
+        since/until are ISO timestamps, bucket is a name from BUCKETS or a
+        number of seconds, group_by is a sequence of DIMENSIONS and filters
+        maps dimensions to lists of accepted values. Returns a list of rows
+        like {'bucket': '2026-01-14T22:00:00', 'type': 'Mobile', 'clicks': 3}.
+        """
+        if isinstance(bucket, str):
+            bucket = BUCKETS[bucket]
+        for dimension in group_by:
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension}")
+
+        # Translate filter values to ids once; unknown values can never match
+        filter_ids = {}
+        for dimension, accepted in (filters or {}).items():
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension: {dimension}")
+            ids = self.value_ids[dimension]
+            filter_ids[dimension] = [ids[value] for value in accepted if value in ids]
+
+        low = to_seconds(since) if since else None
+        high = to_seconds(until) if until else None
+
+        # Copy the rows so far under the lock (one memcpy per column) and
+        # count after releasing it, so clicks recorded meanwhile don't wait
+        with self.lock:
+            rows = len(self.timestamps)
+            deleted = set(self.deleted)
+            if np is not None:
+                timestamps = np.frombuffer(self.timestamps, dtype=np.float64, count=rows).copy()
+                columns = {
+                    dimension: np.frombuffer(column, dtype=np.dtype(column.typecode), count=rows).copy()
+                    for dimension, column in self.columns.items()
+                }
+            else:
+                timestamps = self.timestamps[:rows]
+                columns = {dimension: column[:rows] for dimension, column in self.columns.items()}
+
+        if np is not None:
+            counts = self.count_numpy(timestamps, columns, deleted, low, high, bucket, group_by, filter_ids)
+        else:
+            counts = self.count_python(timestamps, columns, deleted, low, high, bucket, group_by, filter_ids)
+
+        result = []
+        for key, count in sorted(counts.items()):
+            row = {}
+            if bucket:
+                row['bucket'] = from_seconds(key[0] * bucket)
+                key = key[1:]
+            for dimension, value_id in zip(group_by, key):
+                row[dimension] = self.values[dimension][value_id]
+            row['clicks'] = count
+            result.append(row)
+        return result
+
+    def count_numpy(self, timestamps, columns, deleted, low, high, bucket, group_by, filter_ids):
+        """Vectorized counting over NumPy copies of the columns"""
+        mask = np.ones(len(timestamps), dtype=bool)
+        if low is not None:
+            mask &= timestamps >= low
+        if high is not None:
+            mask &= timestamps <= high
+        if deleted:
+            mask &= ~np.isin(columns['code'], np.fromiter(deleted, dtype=np.int64))
+        for dimension, accepted in filter_ids.items():
+            mask &= np.isin(columns[dimension], np.array(accepted, dtype=np.int64))
+
+        keys = []
+        if bucket:
+            keys.append((np.floor(timestamps[mask] / bucket)).astype(np.int64))
+        for dimension in group_by:
+            keys.append(columns[dimension][mask].astype(np.int64))
+
+        if not keys:
+            total = int(mask.sum())
+            return {(): total} if total else {}
+
+        # Pack the key columns into one integer per row, then count unique keys
+        combined = np.zeros(int(mask.sum()), dtype=np.int64)
+        offsets = []
+        for key in keys:
+            offset = int(key.min()) if len(key) else 0
+            radix = int(key.max()) - offset + 1 if len(key) else 1
+            combined = combined * radix + (key - offset)
+            offsets.append((offset, radix))
+
+        unique, counts = np.unique(combined, return_counts=True)
+        result = {}
+        for packed, count in zip(unique.tolist(), counts.tolist()):
+            parts = []
+            for offset, radix in reversed(offsets):
+                packed, part = divmod(packed, radix)
+                parts.append(part + offset)
+            result[tuple(reversed(parts))] = count
+        return result
+
+    def count_python(self, timestamps, columns, deleted, low, high, bucket, group_by, filter_ids):
+        """Fallback counting loop for when NumPy is not installed"""
+        accepted = {dimension: set(ids) for dimension, ids in filter_ids.items()}
+        group_columns = [columns[dimension] for dimension in group_by]
+        codes = columns['code']
+        counts = {}
+        for row in range(len(timestamps)):
+            timestamp = timestamps[row]
+            if low is not None and timestamp < low:
+                continue
+            if high is not None and timestamp > high:
+                continue
+            if codes[row] in deleted:
+                continue
+            if any(columns[dimension][row] not in ids for dimension, ids in accepted.items()):
+                continue
+            key = tuple(column[row] for column in group_columns)
+            if bucket:
+                key = (int(timestamp // bucket),) + key
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+def main(argv):
+    """Command line entry point for offline analytics queries"""
+    parser = argparse.ArgumentParser(description='Query click analytics for a URL store file')
+    parser.add_argument('--store', default='shortened_urls.json', help='URL store file')
+    parser.add_argument('--since', help='Only count clicks at or after this ISO timestamp')
+    parser.add_argument('--until', help='Only count clicks at or before this ISO timestamp')
+    parser.add_argument('--bucket', help='Time bucket: minute, hour, day, week or seconds')
+    parser.add_argument('--group-by', default='', help='Comma separated dimensions: ' + ', '.join(DIMENSIONS))
+    for dimension in DIMENSIONS:
+        parser.add_argument(f'--{dimension}', action='append', help=f'Only count clicks with this {dimension}')
+    args = parser.parse_args(argv)
+
+    bucket = args.bucket
+    if bucket and bucket.isdigit():
+        bucket = int(bucket)
+    filters = {dimension: getattr(args, dimension) for dimension in DIMENSIONS if getattr(args, dimension)}
+    group_by = [dimension for dimension in args.group_by.split(',') if dimension]
+
+    columns = ClickColumns.from_files(args.store)
+    for row in columns.query(args.since, args.until, bucket, group_by, filters):
+        print(json.dumps(row))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,384 @@
+import io
+import json
+import lzma
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+# Clicks older than this many days are moved out of the hot store
+HOT_CLICK_MAX_AGE_DAYS = int(os.environ.get('SHORTENER_HOT_DAYS', '30'))
+
+# Each cold segment covers one calendar day of clicks
+SEGMENT_FORMAT = '%Y%m%d'
+SEGMENT_SUFFIX = '.xz'
+INDEX_FILE = 'index.json'
+
+# (short code, count) entries an ArchiveBuilder buffers before spilling them to disk
+SPILL_BATCH_SIZE = 10000
+
+
+def archive_dir_for(filename):
+    """Get the cold archive directory that belongs to a URL store file"""
+    base, _ = os.path.splitext(filename)
+    return base + '_archive'
+
+
+def segment_name(click):
+    """Name of the day segment a click belongs in"""
+    return click['timestamp'][:10].replace('-', '')
+
+
+class ClickArchive:
+    """Cold tier for click history: append-only, lzma-compressed day segments.
+
+    Every segment file is a concatenation of xz streams, one per archive
+    pass, each holding JSON lines of ``{"code": ..., "click": {...}}``.
+    ``index.json`` records the time range, record count, committed byte
+    size and per-code counts of each segment so range and per-code queries
+    only open the segments that can match.
+
+    self.lock only guards the in-memory index and is never held across
+    compression or disk I/O; writers serialize on self.write_lock instead.
+    Readers only read the committed prefix of a segment, so a stream that
+    is still being appended is never seen half-written.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.write_lock = threading.RLock()
+        # Set when the in-memory index has changes not yet written to disk
+        self.dirty = False
+        # Bumped on every change to the in-memory index
+        self.version = 0
+        self.index = self.load_index()
+
+    def load_index(self):
+        """Load the segment index from disk"""
+        path = os.path.join(self.directory, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                index = json.load(f)
+            # Indexes written before sizes were recorded: the files are complete
+            for name, meta in index['segments'].items():
+                if 'size' not in meta:
+                    meta['size'] = os.path.getsize(self.segment_path(name))
+            return index
+        return {'segments': {}, 'watermarks': {}}
+
+    def save_index(self):
+        """Write the segment index atomically, copying it under the lock only"""
+        with self.write_lock:
+            with self.lock:
+                payload = json.dumps(self.index)
+                self.dirty = False
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, INDEX_FILE)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(payload)
+            os.replace(tmp_path, path)
+
+    def copy_index(self):
+        """Deep-copy the index, returning the version it was copied at and the copy"""
+        with self.lock:
+            return self.version, json.loads(json.dumps(self.index))
+
+    def flush(self):
+        """Write the index if forget() changed it since the last save"""
+        if self.dirty:
+            self.save_index()
+
+    def segment_path(self, name):
+        return os.path.join(self.directory, name + SEGMENT_SUFFIX)
+
+    def watermark(self, short_code):
+        """Timestamp of the newest archived click for a short code"""
+        return self.index['watermarks'].get(short_code)
+
+    def write_segment(self, name, items):
+        """Append one xz stream of (short_code, click) pairs to a segment file.
+
+        Returns the number of bytes written. Call with write_lock held; the
+        index is not touched.
+        """
+        payload = ''.join(
+            json.dumps({'code': code, 'click': click}) + '\n'
+            for code, click in items
+        )
+        data = lzma.compress(payload.encode())
+        with open(self.segment_path(name), 'ab') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return len(data)
+
+    def append(self, records):
+        """Append (short_code, click) pairs to their day segments"""
+        by_segment = {}
+        for short_code, click in records:
+            by_segment.setdefault(segment_name(click), []).append((short_code, click))
+
+        with self.write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            written = {name: self.write_segment(name, items) for name, items in by_segment.items()}
+
+            # Publish the whole pass at once so readers see all of it or none
+            with self.lock:
+                segments = self.index['segments']
+                watermarks = self.index['watermarks']
+                for name, items in by_segment.items():
+                    meta = segments.setdefault(name, {
+                        'start': items[0][1]['timestamp'],
+                        'end': items[0][1]['timestamp'],
+                        'count': 0,
+                        'size': 0,
+                        'codes': {}
+                    })
+                    meta['size'] += written[name]
+                    for code, click in items:
+                        timestamp = click['timestamp']
+                        meta['start'] = min(meta['start'], timestamp)
+                        meta['end'] = max(meta['end'], timestamp)
+                        meta['count'] += 1
+                        meta['codes'][code] = meta['codes'].get(code, 0) + 1
+                        if timestamp > watermarks.get(code, ''):
+                            watermarks[code] = timestamp
+                self.version += 1
+
+            self.save_index()
+
+    def view(self, short_code=None, since=None, until=None):
+        """Get the segments a read needs and the watermarks they cover.
+
+        Returns a sorted list of (segment name, committed size) pairs and a
+        dict of watermarks (only short_code's when one is given). Both come
+        from one lock hold, so a hot click at or before its code's watermark
+        is always one this view already reads from the cold tier.
+        """
+        with self.lock:
+            segments = []
+            for name, meta in self.index['segments'].items():
+                if short_code is not None and short_code not in meta['codes']:
+                    continue
+                if since is not None and meta['end'] < since:
+                    continue
+                if until is not None and meta['start'] > until:
+                    continue
+                segments.append((name, meta['size']))
+            if short_code is None:
+                watermarks = dict(self.index['watermarks'])
+            else:
+                watermark = self.index['watermarks'].get(short_code)
+                watermarks = {short_code: watermark} if watermark else {}
+        return sorted(segments), watermarks
+
+    def read_segment(self, name, size):
+        """Yield (short_code, click) pairs stored in the first size bytes of a segment"""
+        # Segments are append-only, so the committed prefix never changes
+        # and can be read without any lock
+        with open(self.segment_path(name), 'rb') as f:
+            compressed = f.read(size)
+        with lzma.open(io.BytesIO(compressed), 'rt') as f:
+            for line in f:
+                record = json.loads(line)
+                yield record['code'], record['click']
+
+    def iter_clicks(self, short_code=None, since=None, until=None, segments=None):
+        """Yield archived (short_code, click) pairs in a time range.
+
+        segments is a list from view(); by default a fresh view is taken.
+        """
+        if segments is None:
+            segments, _ = self.view(short_code, since, until)
+        for name, size in segments:
+            for code, click in self.read_segment(name, size):
+                if short_code is not None and code != short_code:
+                    continue
+                timestamp = click['timestamp']
+                if since is not None and timestamp < since:
+                    continue
+                if until is not None and timestamp > until:
+                    continue
+                yield code, click
+
+    def get_clicks(self, short_code, since=None, until=None, segments=None):
+        """Get the archived clicks of one short code, oldest first"""
+        clicks = [click for _, click in self.iter_clicks(short_code, since, until, segments)]
+        clicks.sort(key=lambda click: click['timestamp'])
+        return clicks
+
+    def click_count(self, short_code):
+        """Count archived clicks for a short code using only the index"""
+        with self.lock:
+            return sum(meta['codes'].get(short_code, 0)
+                       for meta in self.index['segments'].values())
+
+    def forget(self, short_code):
+        """Drop a deleted short code from the index so queries skip it.
+
+        Only the in-memory index changes; it reaches disk with the next
+        append() or flush(). Losing that on a crash is harmless because
+        readers already skip archived clicks older than a link's creation.
+        """
+        with self.lock:
+            changed = self.index['watermarks'].pop(short_code, None) is not None
+            for meta in self.index['segments'].values():
+                if meta['codes'].pop(short_code, None) is not None:
+                    changed = True
+            if changed:
+                self.dirty = True
+                self.version += 1
+
+
+class ArchiveBuilder:
+    """Bulk-loads clicks into a ClickArchive in bounded memory.
+
+    Meant for offline migrations, with clicks arriving grouped by short
+    code. Segments are appended a batch at a time; each code's per-segment
+    counts and watermark are spilled to temporary files once its clicks
+    are done, so memory does not grow with the number of links. close()
+    writes the index once, streaming it from the spill files merged with
+    what the archive already held; the archive's in-memory index is not
+    updated.
+    """
+
+    def __init__(self, archive, batch_size):
+        self.archive = archive
+        self.batch_size = batch_size
+        self.spill_dir = os.path.join(archive.directory, 'build.tmp')
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir)
+        self.pending = []
+        # Segment metadata of the clicks added here, without per-code counts
+        self.segments = {}
+        self.code = None
+        self.code_counts = {}
+        self.code_watermark = ''
+        self.spilled = {}
+        self.spilled_watermarks = []
+        self.spilled_count = 0
+        self.archived = 0
+
+    def spill_path(self, name):
+        return os.path.join(self.spill_dir, name + '.jsonl')
+
+    def add(self, short_code, click):
+        """Queue one click; all clicks of a code must be added one after another"""
+        if short_code != self.code:
+            self.finish_code()
+            self.code = short_code
+        name = segment_name(click)
+        self.code_counts[name] = self.code_counts.get(name, 0) + 1
+        self.code_watermark = max(self.code_watermark, click['timestamp'])
+        self.pending.append((short_code, click))
+        if len(self.pending) >= self.batch_size:
+            self.write_pending()
+
+    def write_pending(self):
+        by_segment = {}
+        for short_code, click in self.pending:
+            by_segment.setdefault(segment_name(click), []).append((short_code, click))
+        with self.archive.write_lock:
+            for name, items in by_segment.items():
+                written = self.archive.write_segment(name, items)
+                meta = self.segments.setdefault(name, {
+                    'start': items[0][1]['timestamp'],
+                    'end': items[0][1]['timestamp'],
+                    'count': 0,
+                    'size': 0
+                })
+                meta['size'] += written
+                meta['count'] += len(items)
+                for _, click in items:
+                    meta['start'] = min(meta['start'], click['timestamp'])
+                    meta['end'] = max(meta['end'], click['timestamp'])
+        self.archived += len(self.pending)
+        self.pending = []
+
+    def finish_code(self):
+        if self.code is None:
+            return
+        for name, count in self.code_counts.items():
+            self.spilled.setdefault(name, []).append((self.code, count))
+            self.spilled_count += 1
+        self.spilled_watermarks.append((self.code, self.code_watermark))
+        self.spilled_count += 1
+        self.code = None
+        self.code_counts = {}
+        self.code_watermark = ''
+        if self.spilled_count >= SPILL_BATCH_SIZE:
+            self.spill()
+
+    def spill(self):
+        for name, entries in self.spilled.items():
+            with open(self.spill_path(name), 'a') as f:
+                f.writelines(json.dumps(entry) + '\n' for entry in entries)
+        with open(self.spill_path('watermarks'), 'a') as f:
+            f.writelines(json.dumps(entry) + '\n' for entry in self.spilled_watermarks)
+        self.spilled = {}
+        self.spilled_watermarks = []
+        self.spilled_count = 0
+
+    def read_spill(self, name):
+        """Yield the (short code, value) pairs spilled under a name"""
+        path = self.spill_path(name)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    yield tuple(json.loads(line))
+
+    def write_entries(self, f, spilled, existing, merge):
+        """Write the members of a {code: value} object, merging spilled values into existing ones"""
+        first = True
+        for short_code, value in spilled:
+            if short_code in existing:
+                value = merge(value, existing.pop(short_code))
+            f.write(('' if first else ', ') + json.dumps(short_code) + ': ' + json.dumps(value))
+            first = False
+        for short_code, value in existing.items():
+            f.write(('' if first else ', ') + json.dumps(short_code) + ': ' + json.dumps(value))
+            first = False
+
+    def close(self):
+        """Write the remaining clicks, then the merged index, and remove the spill files"""
+        if self.pending:
+            self.write_pending()
+        self.finish_code()
+        self.spill()
+
+        existing = self.archive.index
+        path = os.path.join(self.archive.directory, INDEX_FILE)
+        tmp_path = path + '.tmp'
+        with self.archive.write_lock, open(tmp_path, 'w') as f:
+            f.write('{"segments": {')
+            names = sorted(set(existing['segments']) | set(self.segments))
+            for i, name in enumerate(names):
+                old = existing['segments'].get(name)
+                meta = dict(self.segments.get(name) or old)
+                old_codes = {}
+                if old is not None and name in self.segments:
+                    meta['start'] = min(meta['start'], old['start'])
+                    meta['end'] = max(meta['end'], old['end'])
+                    meta['count'] += old['count']
+                    meta['size'] += old['size']
+                if old is not None:
+                    meta.pop('codes', None)
+                    old_codes = dict(old['codes'])
+                f.write((', ' if i else '') + json.dumps(name) + ': ' + json.dumps(meta)[:-1] + ', "codes": {')
+                self.write_entries(f, self.read_spill(name), old_codes, lambda new, old: new + old)
+                f.write('}}')
+            f.write('}, "watermarks": {')
+            self.write_entries(f, self.read_spill('watermarks'), dict(existing['watermarks']), max)
+            f.write('}}')
+            f.flush()
+            os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+def archive_cutoff(max_age_days=HOT_CLICK_MAX_AGE_DAYS, now=None):
+    """ISO timestamp before which clicks belong in the cold tier"""
+    now = now or datetime.now()
+    return (now - timedelta(days=max_age_days)).isoformat()
@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# Directory holding one URL store file per namespace
+NAMESPACES_DIR = os.environ.get('SHORTENER_NAMESPACES_DIR', 'namespaces')
+
+# Budget for the estimated memory of loaded namespace stores, in bytes
+NAMESPACE_BUDGET = int(os.environ.get('SHORTENER_NAMESPACE_BUDGET_MB', '256')) * 1024 * 1024
+
+NAMESPACE_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+
+def is_valid_namespace(namespace):
+    """Check that a namespace name is safe to use as a file name"""
+    return bool(NAMESPACE_PATTERN.match(namespace))
+
+
+class NamespaceManager:
+    """Lazily loaded per-namespace URL stores with LRU eviction.
+
+    A namespace store is loaded the first time it is accessed and kept in
+    least-recently-used order. When the estimated memory of all loaded
+    stores goes over the budget, the least recently used ones are flushed
+    to disk and dropped from memory. Request threads pin the store they are
+    using with acquire()/release() so it is never dropped from under them.
+
+    Loading and unloading run outside the manager lock so other namespaces
+    stay available; requests for a namespace that is being loaded or
+    unloaded wait for that to finish. A store created for a request that
+    never wrote anything is dropped again when it is released.
+    """
+
+    def __init__(self, store_factory, directory=NAMESPACES_DIR, budget=NAMESPACE_BUDGET):
+        self.store_factory = store_factory
+        self.directory = directory
+        self.budget = budget
+        self.lock = threading.RLock()
+        self.stores = OrderedDict()
+        self.sizes = {}
+        self.pins = {}
+        self.metrics = {}
+        # Namespaces being loaded or unloaded, set when that finishes
+        self.busy = {}
+
+    def path_for(self, namespace):
+        return os.path.join(self.directory, f"{namespace}.json")
+
+    def exists(self, namespace):
+        """Check whether a namespace is loaded or has a store on disk"""
+        return namespace in self.stores or os.path.exists(self.path_for(namespace))
+
+    def namespace_metrics(self, namespace):
+        return self.metrics.setdefault(namespace, {
+            'hits': 0,
+            'loads': 0,
+            'evictions': 0
+        })
+
+    def get(self, namespace, create=False, pin=False):
+        """Get the store for a namespace, loading it on first access.
+
+        Returns None for invalid names, and for namespaces that do not
+        exist yet unless create is True. With pin, the store is pinned in
+        the same step, as acquire() does.
+        """
+        if not is_valid_namespace(namespace):
+            return None
+
+        while True:
+            with self.lock:
+                store = self.stores.get(namespace)
+                if store is not None:
+                    self.stores.move_to_end(namespace)
+                    self.namespace_metrics(namespace)['hits'] += 1
+                    if pin:
+                        self.pins[namespace] = self.pins.get(namespace, 0) + 1
+                    return store
+
+                busy = self.busy.get(namespace)
+                if busy is None:
+                    # Checked before touching metrics so misses on unknown names stay free
+                    if not create and not self.exists(namespace):
+                        return None
+                    busy = self.busy[namespace] = threading.Event()
+                    break
+            busy.wait()
+
+        store = None
+        size = 0
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            store = self.store_factory(self.path_for(namespace))
+            size = store.estimate_memory()
+        finally:
+            with self.lock:
+                del self.busy[namespace]
+                busy.set()
+                if store is not None:
+                    self.stores[namespace] = store
+                    self.sizes[namespace] = size
+                    metrics = self.namespace_metrics(namespace)
+                    metrics['hits'] += 1
+                    metrics['loads'] += 1
+                    if pin:
+                        self.pins[namespace] = self.pins.get(namespace, 0) + 1
+        self.evict(keep=namespace)
+        return store
+
+    def acquire(self, namespace, create=False):
+        """Get a namespace store like get() and pin it until release() is called"""
+        return self.get(namespace, create, pin=True)
+
+    def release(self, namespace):
+        """Unpin a store taken with acquire() and evict idle stores if over budget"""
+        with self.lock:
+            pins = self.pins.pop(namespace, 0) - 1
+            if pins > 0:
+                self.pins[namespace] = pins
+                return
+            store = self.stores.get(namespace)
+        if store is None:
+            return
+
+        if not os.path.exists(store.filename):
+            # Nothing was ever written, e.g. a shorten request that failed
+            # validation; don't keep an empty store around
+            self.unload(namespace, save=False)
+            return
+        size = store.estimate_memory()
+        with self.lock:
+            if self.stores.get(namespace) is store:
+                self.sizes[namespace] = size
+        self.evict(keep=namespace)
+
+    def evict(self, keep=None):
+        """Flush and unload least recently used stores until within budget"""
+        with self.lock:
+            victims = []
+            total = sum(self.sizes.values())
+            for namespace in self.stores:
+                if total <= self.budget:
+                    break
+                # Stores in use by a request are left for a later pass
+                if namespace == keep or namespace in self.pins:
+                    continue
+                victims.append(namespace)
+                total -= self.sizes.get(namespace, 0)
+        for namespace in victims:
+            self.unload(namespace)
+
+    def unload(self, namespace, save=True):
+        """Close a namespace store and drop it from memory.
+
+        With save, the store is flushed to disk and counted as an eviction;
+        without it the store and its metrics are discarded. Stores pinned
+        again in the meantime are left alone.
+        """
+        with self.lock:
+            store = self.stores.get(namespace)
+            if store is None or namespace in self.pins:
+                return
+            del self.stores[namespace]
+            self.sizes.pop(namespace, None)
+            busy = self.busy[namespace] = threading.Event()
+        try:
+            store.close(save)
+        finally:
+            with self.lock:
+                del self.busy[namespace]
+                busy.set()
+                if save:
+                    self.namespace_metrics(namespace)['evictions'] += 1
+                else:
+                    self.metrics.pop(namespace, None)
+
+    def flush_all(self):
+        """Flush every loaded namespace store to disk"""
+        with self.lock:
+            stores = list(self.stores.values())
+        for store in stores:
+            store.save_urls()
+            store.archive.flush()
+
+    def get_metrics(self):
+        """Per-namespace load state, estimated memory and hit metrics"""
+        with self.lock:
+            namespaces = {}
+            for namespace, metrics in self.metrics.items():
+                store = self.stores.get(namespace)
+                namespaces[namespace] = dict(
+                    metrics,
+                    loaded=store is not None,
+                    links=len(store.urls) if store is not None else None,
+                    size=self.sizes.get(namespace)
+                )
+            return {
+                'loaded': len(self.stores),
+                'loaded_size': sum(self.sizes.values()),
+                'budget': self.budget,
+                'namespaces': namespaces
+            }
@@ -0,0 +1,264 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from alias_table import AliasTable
+from namespaces import is_valid_namespace
+from redirects import client_ip, send_not_found, send_redirect
+from shared_table import SharedLinkTable, TableBusy, shared_table_path_for
+
+# Namespace link tables a worker keeps mapped at once
+MAX_OPEN_TABLES = 64
+
+# Clicks sent to the writer per report, and seconds between reports
+CLICK_BATCH_SIZE = 500
+CLICK_REPORT_INTERVAL = 0.5
+
+# Clicks kept for a later report while the writer can't be reached
+MAX_PENDING_CLICKS = 100000
+
+# Seconds to wait for the writer on a forwarded request or a click report
+WRITER_TIMEOUT = 60
+
+# Headers that belong to one connection and are not relayed
+HOP_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'content-length', 'server', 'date'}
+
+
+def start_redirect_workers(listen_socket, writer_port, count, table_path, namespaces_dir):
+    """Start worker processes that accept on the server's listening socket.
+
+    Workers answer /r/ requests from the shared link tables and forward
+    everything else to the writer's internal listener on writer_port.
+    Returns the worker Popen objects.
+    """
+    # Non-blocking, so a process that loses the race for a connection
+    # goes back to waiting instead of blocking in accept()
+    listen_socket.setblocking(False)
+    fd = listen_socket.fileno()
+    command = [
+        sys.executable, os.path.abspath(__file__), str(fd), str(writer_port),
+        os.path.abspath(table_path), os.path.abspath(namespaces_dir)
+    ]
+    return [subprocess.Popen(command, pass_fds=(fd,)) for _ in range(count)]
+
+
+@lru_cache(maxsize=1024)
+def alias_table(weights):
+    """Alias table for a tuple of destination weights, built once per weighting"""
+    return AliasTable(list(weights))
+
+
+class LinkTables:
+    """Read-only shared link tables of the default store and of namespaces.
+
+    A namespace's table only exists once the writer has loaded it; until
+    then its redirects are forwarded to the writer.
+    """
+
+    def __init__(self, default_path, namespaces_dir):
+        self.default = SharedLinkTable(default_path)
+        self.namespaces_dir = namespaces_dir
+        self.lock = threading.Lock()
+        self.namespace_tables = OrderedDict()
+
+    def get(self, namespace=None):
+        """Get the table for a namespace (None for the default store), or None if it has none"""
+        if namespace is None:
+            return self.default
+        with self.lock:
+            table = self.namespace_tables.get(namespace)
+            if table is not None:
+                self.namespace_tables.move_to_end(namespace)
+                return table
+            path = shared_table_path_for(os.path.join(self.namespaces_dir, f"{namespace}.json"))
+            if not os.path.exists(path):
+                return None
+            table = self.namespace_tables[namespace] = SharedLinkTable(path)
+            if len(self.namespace_tables) > MAX_OPEN_TABLES:
+                # A lookup still using it fails with ValueError and is forwarded
+                _, oldest = self.namespace_tables.popitem(last=False)
+                oldest.close()
+            return table
+
+
+class ClickReporter:
+    """Sends the clicks a worker redirected to the writer in batches"""
+
+    def __init__(self, writer_port):
+        self.writer_port = writer_port
+        self.lock = threading.Lock()
+        self.clicks = []
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def add(self, click):
+        with self.lock:
+            self.clicks.append(click)
+
+    def run(self):
+        while True:
+            time.sleep(CLICK_REPORT_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Report pending clicks; on failure keep them (up to a limit) for the next try"""
+        while True:
+            with self.lock:
+                batch = self.clicks[:CLICK_BATCH_SIZE]
+                del self.clicks[:CLICK_BATCH_SIZE]
+            if not batch:
+                return
+            try:
+                self.send(batch)
+            except (OSError, http.client.HTTPException) as e:
+                print(f"[ERROR] Reporting clicks to the writer failed: {e}")
+                with self.lock:
+                    self.clicks[:0] = batch
+                    # Drop the oldest rather than grow without bound
+                    del self.clicks[:-MAX_PENDING_CLICKS]
+                return
+
+    def send(self, batch):
+        connection = http.client.HTTPConnection('127.0.0.1', self.writer_port, timeout=WRITER_TIMEOUT)
+        try:
+            connection.request('POST', '/internal/clicks', json.dumps(batch),
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        if response.status != 200:
+            raise OSError(f"writer answered {response.status}")
+
+
+class RedirectWorkerHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/r/') and self.serve_redirect():
+            return
+        self.forward()
+
+    def do_POST(self):
+        self.forward()
+
+    def serve_redirect(self):
+        """Answer a /r/ request from the shared tables; False if the writer has to"""
+        parts = self.path[3:].split('/')
+        if len(parts) == 2:
+            namespace, short_code = parts
+            if not is_valid_namespace(namespace):
+                send_not_found(self)
+                return True
+        else:
+            namespace, short_code = None, self.path[3:]
+
+        table = tables.get(namespace)
+        if table is None:
+            return False
+        try:
+            original_url, destinations = table.get(short_code)
+        except (TableBusy, ValueError):
+            # A slot stuck mid-update, or a table closed by get() meanwhile
+            return False
+        if original_url is None:
+            send_not_found(self)
+            return True
+
+        click = {
+            'namespace': namespace,
+            'code': short_code,
+            'timestamp': datetime.now().isoformat(),
+            'user_agent': self.headers.get('User-Agent', 'Unknown'),
+            'ip': client_ip(self)
+        }
+        if destinations:
+            weights = tuple(weight for _, weight in destinations)
+            original_url = destinations[alias_table(weights).pick()][0]
+            click['destination'] = original_url
+        send_redirect(self, original_url)
+        reporter.add(click)
+        return True
+
+    def forward(self):
+        """Relay the request to the writer process and its response back"""
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length) if content_length else None
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_HEADERS}
+        headers['X-Forwarded-For'] = client_ip(self)
+
+        connection = http.client.HTTPConnection('127.0.0.1', writer_port, timeout=WRITER_TIMEOUT)
+        try:
+            connection.request(self.command, self.path, body, headers)
+            response = connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            print(f"[ERROR] Forwarding to the writer failed: {e}")
+            self.send_response(502)
+            self.end_headers()
+            return
+        finally:
+            connection.close()
+
+        self.send_response(response.status)
+        for name, value in response.getheaders():
+            if name.lower() not in HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Suppress logging
+
+
+class WorkerHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def exit_with_parent():
+    """Stop this worker if the writer that started it goes away without stopping it"""
+    parent = os.getppid()
+    while os.getppid() == parent:
+        time.sleep(1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+tables = None
+reporter = None
+writer_port = None
+
+
+def main(argv):
+    """Worker entry point: <listening socket fd> <writer port> <table file> <namespaces dir>"""
+    global tables, reporter, writer_port
+    listen_fd, writer_port = int(argv[0]), int(argv[1])
+    tables = LinkTables(argv[2], argv[3])
+    reporter = ClickReporter(writer_port)
+
+    server = WorkerHTTPServer(('', 0), RedirectWorkerHandler, bind_and_activate=False)
+    server.socket.close()
+    server.socket = socket.socket(fileno=listen_fd)
+    server.server_address = server.socket.getsockname()
+
+    # Stopped by the writer with SIGTERM; report the last clicks on the way out
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    threading.Thread(target=exit_with_parent, daemon=True).start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reporter.flush()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
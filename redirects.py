@@ -0,0 +1,123 @@
+# Response body for unknown short codes, built once
+NOT_FOUND_PAGE = b'<h1>404 - Short code not found</h1>'
+
+
+def client_ip(handler):
+    """Get a request's client IP, preferring the first X-Forwarded-For entry (for proxies)"""
+    user_ip = handler.headers.get('X-Forwarded-For', handler.client_address[0])
+    if ',' in user_ip:
+        # If multiple IPs, take the first one
+        user_ip = user_ip.split(',')[0].strip()
+    return user_ip
+
+
+def send_redirect(handler, original_url):
+    """Send the response that takes a visitor to original_url"""
+    # Check if it's a YouTube link
+    if 'youtube.com' in original_url or 'youtu.be' in original_url:
+        # Show popup for YouTube links
+        handler.send_response(200)
+        handler.send_header('Content-type', 'text/html')
+        handler.end_headers()
+        
+        html = f'''
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Redirecting...</title>
+            <style>
+                * {{
+                    margin: 0;
+                    padding: 0;
+                    box-sizing: border-box;
+                }}
+                body {{
+                    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+                    background: #f0f0f0;
+                    display: flex;
+                    justify-content: center;
+                    align-items: center;
+                    min-height: 100vh;
+                }}
+                .overlay {{
+                    position: fixed;
+                    top: 0;
+                    left: 0;
+                    right: 0;
+                    bottom: 0;
+                    background: rgba(0, 0, 0, 0.5);
+                    display: flex;
+                    justify-content: center;
+                    align-items: center;
+                    z-index: 1000;
+                }}
+                .popup {{
+                    background: white;
+                    border-radius: 12px;
+                    box-shadow: 0 10px 40px rgba(0, 0, 0, 0.3);
+                    padding: 40px;
+                    text-align: center;
+                    min-width: 300px;
+                    animation: slideIn 0.3s ease-out;
+                }}
+                @keyframes slideIn {{
+                    from {{
+                        transform: translateY(-20px);
+                        opacity: 0;
+                    }}
+                    to {{
+                        transform: translateY(0);
+                        opacity: 1;
+                    }}
+                }}
+                .popup h2 {{
+                    color: #333;
+                    margin-bottom: 20px;
+                    font-size: 24px;
+                }}
+                .popup button {{
+                    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                    color: white;
+                    border: none;
+                    padding: 12px 30px;
+                    border-radius: 6px;
+                    font-size: 14px;
+                    font-weight: 600;
+                    cursor: pointer;
+                    transition: transform 0.2s, box-shadow 0.2s;
+                }}
+                .popup button:hover {{
+                    transform: translateY(-2px);
+                    box-shadow: 0 5px 20px rgba(102, 126, 234, 0.4);
+                }}
+            </style>
+        </head>
+        <body>
+            <div class="overlay">
+                <div class="popup">
+                    <h2>Please turn on your location as of the new Youtube Guidelines. <br> This is to ensure no person uses a VPN to hide their age and/or view restricted content.</h2>
+                    <button onclick="redirectToURL()">Okay</button>
+                </div>
+            </div>
+            <script>
+                function redirectToURL() {{
+                    window.location.href = '{original_url}';
+                }}
+            </script>
+        </body>
+        </html>
+        '''
+        handler.wfile.write(html.encode())
+    else:
+        # Direct redirect for non-YouTube links
+        handler.send_response(302)
+        handler.send_header('Location', original_url)
+        handler.end_headers()
+
+
+def send_not_found(handler):
+    """Send the page for an unknown short code"""
+    handler.send_response(404)
+    handler.send_header('Content-type', 'text/html')
+    handler.end_headers()
+    handler.wfile.write(NOT_FOUND_PAGE)
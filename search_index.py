@@ -0,0 +1,163 @@
+import bisect
+import re
+from urllib.parse import urlparse
+
+# Length of the longest n-grams indexed for substring search over original
+# URLs; shorter ones are indexed too so short queries are a single lookup
+NGRAM_SIZE = 3
+
+VANITY_CODE_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+def ngrams(text, size=NGRAM_SIZE):
+    """Get the set of n-grams in a lowercased string"""
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def index_grams(text):
+    """Get every n-gram of a lowercased string up to NGRAM_SIZE long"""
+    grams = set()
+    for size in range(1, NGRAM_SIZE + 1):
+        grams |= ngrams(text, size)
+    return grams
+
+
+def domain_key(url_or_host):
+    """Reverse a host name's labels so subdomains sort next to their parent"""
+    host = urlparse(url_or_host).hostname if '//' in url_or_host else url_or_host
+    host = (host or '').lower().rstrip('.')
+    return '.'.join(reversed(host.split('.'))) if host else ''
+
+
+def prefix_range(sorted_list, prefix):
+    """Get the slice bounds of entries in a sorted list starting with prefix"""
+    start = bisect.bisect_left(sorted_list, prefix)
+    end = bisect.bisect_left(sorted_list, prefix + '\uffff')
+    return start, end
+
+
+class SearchIndex:
+    """Incremental search index over short codes and original URLs.
+
+    Keeps a sorted array of codes for prefix lookups, a sorted array of
+    reversed host names for domain lookups and an n-gram posting index
+    for substring matches in original URLs. by_url maps each original URL
+    to its codes in creation order, so deleting one still finds the rest;
+    weighted links are left out of it so new links never dedupe onto one. Lookups only touch the
+    entries that can match, so they cost time proportional to the number
+    of results rather than the size of the store.
+    """
+
+    def __init__(self, urls=None):
+        self.rebuild(urls or {})
+
+    def rebuild(self, urls):
+        """Rebuild the whole index from a URL mapping"""
+        self.codes = []
+        self.domains = []
+        self.by_url = {}
+        self.urls = {}
+        self.postings = {}
+        # Append and sort once; insort per link would make loading quadratic
+        for code, data in urls.items():
+            original_url = data['original_url']
+            self.urls[code] = original_url
+            if 'destinations' not in data:
+                self.by_url.setdefault(original_url, {})[code] = None
+            self.codes.append(code.lower() + '\0' + code)
+            self.domains.append(domain_key(original_url) + '\0' + code)
+            for gram in index_grams(original_url.lower()):
+                self.postings.setdefault(gram, set()).add(code)
+        self.codes.sort()
+        self.domains.sort()
+
+    def add(self, code, original_url, weighted=False):
+        """Index a new short code, or re-index a changed one"""
+        if code in self.urls:
+            self.remove(code)
+        self.urls[code] = original_url
+        if not weighted:
+            self.by_url.setdefault(original_url, {})[code] = None
+        bisect.insort(self.codes, code.lower() + '\0' + code)
+        bisect.insort(self.domains, domain_key(original_url) + '\0' + code)
+        for gram in index_grams(original_url.lower()):
+            self.postings.setdefault(gram, set()).add(code)
+
+    def remove(self, code):
+        """Remove a deleted short code from the index"""
+        original_url = self.urls.pop(code, None)
+        if original_url is None:
+            return
+        codes = self.by_url.get(original_url)
+        if codes is not None:
+            codes.pop(code, None)
+            if not codes:
+                del self.by_url[original_url]
+        self.discard_sorted(self.codes, code.lower() + '\0' + code)
+        self.discard_sorted(self.domains, domain_key(original_url) + '\0' + code)
+        for gram in index_grams(original_url.lower()):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(code)
+                if not posting:
+                    del self.postings[gram]
+
+    def discard_sorted(self, sorted_list, entry):
+        i = bisect.bisect_left(sorted_list, entry)
+        if i < len(sorted_list) and sorted_list[i] == entry:
+            del sorted_list[i]
+
+    def find_url(self, original_url):
+        """Get the oldest short code already pointing at an original URL, if any"""
+        return next(iter(self.by_url.get(original_url, ())), None)
+
+    def code_prefix(self, prefix):
+        """Get short codes starting with a prefix"""
+        start, end = prefix_range(self.codes, prefix.lower())
+        return {entry.split('\0', 1)[1] for entry in self.codes[start:end]}
+
+    def domain(self, host):
+        """Get short codes whose URL is on a host or one of its subdomains"""
+        key = domain_key(host)
+        if not key:
+            return set()
+        matches = set()
+        for prefix in (key + '\0', key + '.'):
+            start, end = prefix_range(self.domains, prefix)
+            matches.update(entry.split('\0', 1)[1] for entry in self.domains[start:end])
+        return matches
+
+    def substring(self, text):
+        """Get short codes whose original URL contains a substring"""
+        text = text.lower()
+        if len(text) <= NGRAM_SIZE:
+            # Short queries are indexed n-grams themselves, so the posting is exact
+            return set(self.postings.get(text, ()))
+
+        postings = []
+        for gram in ngrams(text):
+            posting = self.postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return candidates
+        return {code for code in candidates if text in self.urls[code].lower()}
+
+    def search(self, query=None, domain=None):
+        """Get short codes matching a code prefix or URL substring and/or a domain"""
+        matches = None
+        if query:
+            matches = self.code_prefix(query) | self.substring(query)
+        if domain:
+            on_domain = self.domain(domain)
+            matches = on_domain if matches is None else matches & on_domain
+        return sorted(matches or ())
+
+    def is_available(self, code):
+        """Check whether a custom vanity code is valid and unused"""
+        return bool(VANITY_CODE_PATTERN.match(code)) and code not in self.urls
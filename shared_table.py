@@ -0,0 +1,364 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MAGIC = b'URLTBL02'
+
+# magic, moved flag, capacity, arena size, arena used, count, tombstones, generation
+HEADER = struct.Struct('<8sIIQQQQQ')
+HEADER_SIZE = 64
+
+# seq (odd while being written), hash, record offset, record length
+SLOT = struct.Struct('<IIQI4x')
+
+# code length, url length, destinations length; followed by the utf-8 code,
+# url and, for weighted links, a JSON list of [url, weight] pairs
+RECORD = struct.Struct('<HII')
+
+EMPTY = 0
+TOMBSTONE = 1
+ARENA_START = 8
+
+INITIAL_CAPACITY = 1024
+INITIAL_ARENA_SIZE = 256 * 1024
+MAX_LOAD = 0.7
+
+# Reads of a slot that a writer is updating retried before backing off
+READ_SPINS = 100
+
+# Seconds a reader waits for a slot a writer is updating before giving up
+READ_TIMEOUT = 0.05
+
+
+def shared_table_path_for(filename):
+    """Get the shared link table file that belongs to a URL store file"""
+    base, _ = os.path.splitext(filename)
+    return base + '.table'
+
+
+class TableBusy(RuntimeError):
+    """A slot stayed mid-update for longer than READ_TIMEOUT"""
+
+
+def code_hash(code):
+    # zlib.crc32 rather than hash(): it must agree across processes
+    return zlib.crc32(code)
+
+
+def link_destinations(data):
+    """Get the (url, weight) pairs of a stored link, or None for a plain link"""
+    if 'destinations' not in data:
+        return None
+    return [(destination['url'], destination['weight']) for destination in data['destinations']]
+
+
+def encode_destinations(destinations):
+    if not destinations:
+        return b''
+    return json.dumps([list(destination) for destination in destinations]).encode()
+
+
+def pack_record(code, url, destinations):
+    return RECORD.pack(len(code), len(url), len(destinations)) + code + url + destinations
+
+
+class SharedLinkTable:
+    """Read-optimized code -> URL table in an mmap'd file shared by processes.
+
+    The file holds a header, an open-addressing array of fixed-size slots
+    and an append-only string arena. Each slot points at a record in the
+    arena and carries a sequence counter that a writer makes odd while it
+    updates the slot, so readers retry instead of seeing a torn entry.
+    Records are never overwritten in place, so a slot that read
+    consistently always points at complete bytes.
+
+    There is a single writer, which holds a file lock on the table for its
+    whole lifetime (so writing needs fcntl); opening a second writer fails.
+    When the table fills up the writer builds a bigger,
+    compacted file, sets the old header's moved flag and renames the new
+    file over the old one; readers notice the flag and reopen the path.
+    Within a process, lookups and writes share self.lock because they share
+    the mapping that a reopen swaps out.
+    """
+
+    def __init__(self, path, writable=False):
+        if writable and fcntl is None:
+            raise RuntimeError("A writable shared link table needs fcntl for its cross-process lock")
+        self.path = path
+        self.writable = writable
+        self.lock = threading.Lock()
+        self.lock_file = None
+        if writable:
+            self.lock_file = open(path + '.lock', 'a+')
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self.lock_file.close()
+                raise RuntimeError(f"{path} is already open for writing by another table or process")
+            if not os.path.exists(path):
+                self.create(path, INITIAL_CAPACITY, INITIAL_ARENA_SIZE)
+        try:
+            self.open()
+        except ValueError:
+            if not writable:
+                raise
+            # A file in an older layout; the writer refills it anyway
+            self.create(path, INITIAL_CAPACITY, INITIAL_ARENA_SIZE)
+            self.open()
+
+    @staticmethod
+    def create(path, capacity, arena_size):
+        """Write an empty table file"""
+        tmp_path = path + '.tmp'
+        size = HEADER_SIZE + capacity * SLOT.size + arena_size
+        with open(tmp_path, 'wb') as f:
+            f.truncate(size)
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, 0, capacity, arena_size, ARENA_START, 0, 0, 0))
+        os.replace(tmp_path, path)
+
+    def open(self):
+        """Map the table file at self.path"""
+        with open(self.path, 'r+b' if self.writable else 'rb') as f:
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self.map = mmap.mmap(f.fileno(), 0, access=access)
+        magic, _, self.capacity, self.arena_size, _, _, _, _ = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a shared link table")
+        self.slots_start = HEADER_SIZE
+        self.arena_offset = HEADER_SIZE + self.capacity * SLOT.size
+
+    def close(self):
+        with self.lock:
+            self.map.close()
+            if self.lock_file is not None:
+                # Releases the writer lock
+                self.lock_file.close()
+
+    def header(self):
+        _, moved, capacity, arena_size, used, count, tombstones, generation = HEADER.unpack_from(self.map, 0)
+        return moved, used, count, tombstones, generation
+
+    def write_header(self, used, count, tombstones, generation, moved=0):
+        HEADER.pack_into(self.map, 0, MAGIC, moved, self.capacity, self.arena_size,
+                         used, count, tombstones, generation)
+
+    def slot_position(self, index):
+        return self.slots_start + index * SLOT.size
+
+    def read_slot(self, index):
+        """Read a slot consistently, retrying while a writer holds it.
+
+        Spins briefly, then yields the CPU in case the writer was preempted
+        mid-update, and raises TableBusy after READ_TIMEOUT so callers can
+        fall back to another source.
+        """
+        position = self.slot_position(index)
+        attempts = 0
+        deadline = None
+        while True:
+            seq, hashed, offset, length = SLOT.unpack_from(self.map, position)
+            if not seq & 1 and SLOT.unpack_from(self.map, position)[0] == seq:
+                return hashed, offset, length
+            attempts += 1
+            if attempts < READ_SPINS:
+                continue
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + READ_TIMEOUT
+            elif now > deadline:
+                raise TableBusy("Shared link table slot kept changing while being read")
+            time.sleep(0 if attempts < 2 * READ_SPINS else 0.001)
+
+    def read_record(self, offset):
+        """Get the code, url and destinations bytes of a record"""
+        start = self.arena_offset + offset
+        code_length, url_length, destinations_length = RECORD.unpack_from(self.map, start)
+        start += RECORD.size
+        code = self.map[start:start + code_length]
+        start += code_length
+        url = self.map[start:start + url_length]
+        start += url_length
+        return code, url, self.map[start:start + destinations_length]
+
+    def find(self, code):
+        """Probe for a code, returning (slot index, record) or (free slot index, None)"""
+        hashed = code_hash(code)
+        free = None
+        index = hashed % self.capacity
+        for _ in range(self.capacity):
+            slot_hash, offset, _ = self.read_slot(index)
+            if offset == EMPTY:
+                return (index if free is None else free), None
+            if offset == TOMBSTONE:
+                if free is None:
+                    free = index
+            elif slot_hash == hashed:
+                record = self.read_record(offset)
+                if record[0] == code:
+                    return index, record
+            index = (index + 1) % self.capacity
+        return free, None
+
+    def get(self, code):
+        """Get (url, destinations) for a short code, or (None, None).
+
+        destinations is a list of (url, weight) pairs for weighted links
+        and None otherwise. Safe to call from any process; raises TableBusy
+        if a slot stays mid-update.
+        """
+        with self.lock:
+            self.reopen_if_moved()
+            _, record = self.find(code.encode())
+        if record is None:
+            return None, None
+        _, url, destinations = record
+        if destinations:
+            destinations = [tuple(destination) for destination in json.loads(destinations)]
+        return url.decode(), destinations or None
+
+    def lookup(self, code):
+        """Get the URL for a short code, or None; safe to call from any process"""
+        return self.get(code)[0]
+
+    def __contains__(self, code):
+        return self.lookup(code) is not None
+
+    # Writer side
+
+    def write_slot(self, index, hashed, offset, length):
+        """Update a slot under its sequence counter"""
+        position = self.slot_position(index)
+        seq = SLOT.unpack_from(self.map, position)[0]
+        struct.pack_into('<I', self.map, position, seq + 1)
+        SLOT.pack_into(self.map, position, seq + 1, hashed, offset, length)
+        struct.pack_into('<I', self.map, position, (seq + 2) & 0xFFFFFFFF)
+
+    def put(self, code, url, destinations=None):
+        """Insert or update a short code, with (url, weight) pairs for a weighted link"""
+        code = code.encode()
+        record = pack_record(code, url.encode(), encode_destinations(destinations))
+        with self.lock:
+            self.reopen_if_moved()
+            moved, used, count, tombstones, generation = self.header()
+            if ((count + tombstones + 1) > self.capacity * MAX_LOAD
+                    or used + len(record) > self.arena_size):
+                self.grow(len(record))
+                moved, used, count, tombstones, generation = self.header()
+
+            index, existing = self.find(code)
+            reused_tombstone = existing is None and self.read_slot(index)[1] == TOMBSTONE
+
+            # Write the record before publishing it in the slot
+            start = self.arena_offset + used
+            self.map[start:start + len(record)] = record
+            self.write_slot(index, code_hash(code), used, len(record))
+
+            if existing is None:
+                count += 1
+                if reused_tombstone:
+                    tombstones -= 1
+            self.write_header(used + len(record), count, tombstones, generation + 1)
+
+    def remove(self, code):
+        """Delete a short code, leaving a tombstone in its slot"""
+        code = code.encode()
+        with self.lock:
+            self.reopen_if_moved()
+            index, existing = self.find(code)
+            if existing is None:
+                return False
+            moved, used, count, tombstones, generation = self.header()
+            self.write_slot(index, 0, TOMBSTONE, 0)
+            self.write_header(used, count - 1, tombstones + 1, generation + 1)
+            return True
+
+    def entries(self):
+        """Yield every live (code, url, destinations) record as bytes"""
+        for index in range(self.capacity):
+            _, offset, _ = self.read_slot(index)
+            if offset not in (EMPTY, TOMBSTONE):
+                yield self.read_record(offset)
+
+    def rebuild(self, links, extra_arena=0):
+        """Replace the table file with a compacted one holding exactly links.
+
+        links is an iterable of (code, url, destinations) records as bytes.
+        Readers keep using the old mapping until they see its moved flag.
+        """
+        links = [pack_record(*link) for link in links]
+        capacity = INITIAL_CAPACITY
+        while len(links) + 1 > capacity * MAX_LOAD / 2:
+            capacity *= 2
+        needed = ARENA_START + extra_arena + sum(len(record) for record in links)
+        arena_size = INITIAL_ARENA_SIZE
+        while arena_size < needed * 2:
+            arena_size *= 2
+
+        new_path = self.path + '.new'
+        self.create(new_path, capacity, arena_size)
+        with open(new_path, 'r+b') as f:
+            new_map = mmap.mmap(f.fileno(), 0)
+        arena_offset = HEADER_SIZE + capacity * SLOT.size
+        used = ARENA_START
+        for record in links:
+            code = record[RECORD.size:RECORD.size + RECORD.unpack_from(record)[0]]
+            index = code_hash(code) % capacity
+            while SLOT.unpack_from(new_map, HEADER_SIZE + index * SLOT.size)[2] != EMPTY:
+                index = (index + 1) % capacity
+            new_map[arena_offset + used:arena_offset + used + len(record)] = record
+            SLOT.pack_into(new_map, HEADER_SIZE + index * SLOT.size, 0, code_hash(code), used, len(record))
+            used += len(record)
+        generation = self.header()[4] + 1
+        HEADER.pack_into(new_map, 0, MAGIC, 0, capacity, arena_size, used, len(links), 0, generation)
+        new_map.flush()
+        new_map.close()
+
+        # Flag and unmap the old file before the rename, which Windows refuses
+        # while a mapping is open; a reader that reopens early still finds the
+        # old file and simply reopens again once the new one is in place
+        moved, old_used, count, tombstones, generation = self.header()
+        self.write_header(old_used, count, tombstones, generation, moved=1)
+        self.map.close()
+        os.replace(new_path, self.path)
+        self.open()
+
+    def grow(self, extra_arena):
+        """Rebuild into a bigger file once the slots or the arena run out"""
+        self.rebuild(list(self.entries()), extra_arena)
+
+    def reopen_if_moved(self):
+        """Switch to the new file after a writer grew the table"""
+        if self.header()[0]:
+            self.map.close()
+            self.open()
+
+    def load(self, urls):
+        """Replace the table contents with a URL store's links"""
+        with self.lock:
+            self.rebuild(
+                (code.encode(), data['original_url'].encode(), encode_destinations(link_destinations(data)))
+                for code, data in urls.items()
+            )
+
+    def get_metrics(self):
+        with self.lock:
+            _, used, count, tombstones, generation = self.header()
+        return {
+            'path': self.path,
+            'links': count,
+            'capacity': self.capacity,
+            'tombstones': tombstones,
+            'arena_used': used,
+            'arena_size': self.arena_size,
+            'generation': generation
+        }
@@ -0,0 +1,339 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime
+
+from click_archive import INDEX_FILE, SEGMENT_SUFFIX, archive_dir_for
+
+# Same default as url_shortener_web.URLS_FILE; not imported so that the
+# command line tools work on a store file the server can't load
+DEFAULT_URLS_FILE = 'shortened_urls.json'
+
+MANIFEST_FILE = 'manifest.json'
+URLS_SNAPSHOT_FILE = 'urls.json'
+
+# Seconds between scheduled snapshots, 0 disables the schedule
+SNAPSHOT_INTERVAL = int(os.environ.get('SHORTENER_SNAPSHOT_INTERVAL', '0'))
+
+# Number of snapshots kept by the scheduler before the oldest are removed
+SNAPSHOT_KEEP = int(os.environ.get('SHORTENER_SNAPSHOT_KEEP', '24'))
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Links copied per acquisition of the store lock while capturing a snapshot
+CAPTURE_BATCH_SIZE = 1000
+
+# Times the archive index is copied before the store lock is taken; after
+# that it is copied with the store lock held
+CAPTURE_ATTEMPTS = 3
+
+# Held from the start of a snapshot until it is written; one at a time
+snapshot_in_flight = threading.Lock()
+
+
+def snapshot_dir_for(filename):
+    """Get the snapshot directory that belongs to a URL store file"""
+    base, _ = os.path.splitext(filename)
+    return base + '_snapshots'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_link(data):
+    """Copy a link's mutable parts, remembering how many clicks it had"""
+    clicks = data['clicks']
+    count = len(clicks) if isinstance(clicks, list) else None
+    link = dict(data)
+    if 'destinations' in link:
+        # Hit counters are updated in place on every redirect
+        link['destinations'] = [dict(destination) for destination in link['destinations']]
+    return link, count
+
+
+class Snapshot:
+    """A point-in-time view of a URL store, captured copy-on-write.
+
+    Capture starts by taking the list of links and the archive index in
+    one store lock hold. The links are then copied a batch at a time so
+    redirects can take the lock in between; a link about to be changed
+    before its batch is reached is copied first by the store (see
+    URLShortener.preserve), so every link is written as it was at the
+    start. Click lists only grow (archiving swaps in a new list rather
+    than trimming the old one), so a copy only needs their length. Cold
+    archive segments are append-only too and are captured as byte lengths.
+    """
+
+    def __init__(self, store):
+        self.created_at = datetime.now()
+        self.name = 'snapshot-' + self.created_at.strftime('%Y%m%dT%H%M%S%f')
+        self.directory = snapshot_dir_for(store.filename)
+        self.archive_dir = store.archive.directory
+        self.copies = {}
+
+        # The archive index has to be the one in effect when the links are
+        # taken: copy it first and check nothing changed it in the meantime
+        attempts = 0
+        while True:
+            attempts += 1
+            version, archive_index = store.archive.copy_index()
+            with store.lock:
+                if store.archive.version != version:
+                    if attempts < CAPTURE_ATTEMPTS:
+                        continue
+                    _, archive_index = store.archive.copy_index()
+                self.order = list(store.urls)
+                # Links not copied yet; preserve() takes them out early
+                self.remaining = dict(store.urls)
+                store.captures.append(self)
+            break
+        self.archive_index = archive_index
+
+        try:
+            for start in range(0, len(self.order), CAPTURE_BATCH_SIZE):
+                with store.lock:
+                    for code in self.order[start:start + CAPTURE_BATCH_SIZE]:
+                        self.preserve(code)
+        finally:
+            with store.lock:
+                store.captures.remove(self)
+
+        # Only the committed prefix of each segment is captured, so a stream
+        # still being appended is left out along with its index entry
+        self.segment_sizes = {
+            name + SEGMENT_SUFFIX: meta['size']
+            for name, meta in self.archive_index['segments'].items()
+        }
+
+    def preserve(self, short_code):
+        """Copy a link if it hasn't been copied yet; called with the store lock held"""
+        data = self.remaining.pop(short_code, None)
+        if data is not None:
+            self.copies[short_code] = copy_link(data)
+
+    def write_urls(self, path):
+        """Stream the captured links as a shortened_urls.json compatible file"""
+        watermarks = self.archive_index['watermarks']
+        with open(path, 'w') as f:
+            f.write('{')
+            for i, code in enumerate(self.order):
+                data, count = self.copies[code]
+                if count is not None:
+                    # Clicks at or before the watermark are in the captured archive
+                    watermark = watermarks.get(code, '')
+                    data['clicks'] = [click for click in data['clicks'][:count] if click['timestamp'] > watermark]
+                f.write(',\n' if i else '\n')
+                f.write(json.dumps(code) + ': ' + json.dumps(data))
+            f.write('\n}\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_archive(self, directory):
+        """Copy the captured prefix of every archive segment and the index"""
+        os.makedirs(directory, exist_ok=True)
+        for filename, size in self.segment_sizes.items():
+            with open(os.path.join(self.archive_dir, filename), 'rb') as src, \
+                    open(os.path.join(directory, filename), 'wb') as dst:
+                remaining = size
+                while remaining:
+                    chunk = src.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    remaining -= len(chunk)
+        with open(os.path.join(directory, INDEX_FILE), 'w') as f:
+            json.dump(self.archive_index, f)
+
+    def write(self):
+        """Write the snapshot to a temporary directory and rename it into place"""
+        final_dir = os.path.join(self.directory, self.name)
+        tmp_dir = final_dir + '.tmp'
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        self.write_urls(os.path.join(tmp_dir, URLS_SNAPSHOT_FILE))
+        self.write_archive(os.path.join(tmp_dir, 'archive'))
+
+        checksums = {}
+        for root, _, files in os.walk(tmp_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                checksums[os.path.relpath(path, tmp_dir).replace(os.sep, '/')] = file_sha256(path)
+
+        manifest = {
+            'name': self.name,
+            'created_at': self.created_at.isoformat(),
+            'links': len(self.order),
+            'checksums': checksums
+        }
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_dir, final_dir)
+        return manifest
+
+
+def take_snapshot(store, background=True, keep=SNAPSHOT_KEEP):
+    """Capture a snapshot of a store, write it out and prune old snapshots.
+
+    Only the capture runs on the calling thread; with background=True the
+    (slow) write happens on a separate thread so redirects keep flowing.
+    Returns the snapshot name, or None if another snapshot is in progress.
+    """
+    if not snapshot_in_flight.acquire(blocking=False):
+        return None
+    try:
+        snapshot = Snapshot(store)
+    except BaseException:
+        snapshot_in_flight.release()
+        raise
+
+    def write():
+        try:
+            snapshot.write()
+            prune_snapshots(store.filename, keep)
+        finally:
+            snapshot_in_flight.release()
+
+    if background:
+        threading.Thread(target=write, daemon=True).start()
+    else:
+        write()
+    return snapshot.name
+
+
+def list_snapshots(filename):
+    """List completed snapshot names for a store file, oldest first"""
+    directory = snapshot_dir_for(filename)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        name for name in os.listdir(directory)
+        if os.path.exists(os.path.join(directory, name, MANIFEST_FILE))
+    )
+
+
+def verify_snapshot(filename, name):
+    """Check a snapshot's checksums and that its URL file parses.
+
+    Returns a list of problems, empty if the snapshot is good.
+    """
+    snapshot_dir = os.path.join(snapshot_dir_for(filename), name)
+    manifest_path = os.path.join(snapshot_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return [f"{name}: missing {MANIFEST_FILE}"]
+
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    problems = []
+    for relative_path, checksum in manifest['checksums'].items():
+        path = os.path.join(snapshot_dir, relative_path)
+        if not os.path.exists(path):
+            problems.append(f"{relative_path}: missing")
+        elif file_sha256(path) != checksum:
+            problems.append(f"{relative_path}: checksum mismatch")
+
+    if not problems:
+        try:
+            with open(os.path.join(snapshot_dir, URLS_SNAPSHOT_FILE), 'r') as f:
+                json.load(f)
+        except ValueError as e:
+            problems.append(f"{URLS_SNAPSHOT_FILE}: {e}")
+    return problems
+
+
+def restore_snapshot(filename, name):
+    """Replace a store file and its cold archive with a verified snapshot.
+
+    Run this while the server is stopped.
+    """
+    problems = verify_snapshot(filename, name)
+    if problems:
+        raise ValueError(f"Snapshot {name} failed verification: {'; '.join(problems)}")
+
+    snapshot_dir = os.path.join(snapshot_dir_for(filename), name)
+
+    tmp_path = filename + '.restore'
+    shutil.copyfile(os.path.join(snapshot_dir, URLS_SNAPSHOT_FILE), tmp_path)
+    os.replace(tmp_path, filename)
+
+    archive_dir = archive_dir_for(filename)
+    tmp_archive = archive_dir + '.restore'
+    shutil.rmtree(tmp_archive, ignore_errors=True)
+    shutil.copytree(os.path.join(snapshot_dir, 'archive'), tmp_archive)
+    if os.path.exists(archive_dir):
+        shutil.rmtree(archive_dir)
+    os.replace(tmp_archive, archive_dir)
+
+
+def prune_snapshots(filename, keep=SNAPSHOT_KEEP):
+    """Remove all but the newest keep snapshots"""
+    directory = snapshot_dir_for(filename)
+    for name in list_snapshots(filename)[:-keep or None]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def start_snapshot_schedule(store, interval=SNAPSHOT_INTERVAL, keep=SNAPSHOT_KEEP):
+    """Take a snapshot of a store every interval seconds on a daemon thread"""
+    if interval <= 0:
+        return None
+
+    stop = threading.Event()
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                # Skipped if a snapshot requested through the API is still running
+                take_snapshot(store, background=False, keep=keep)
+            except Exception as e:
+                print(f"[ERROR] Scheduled snapshot failed: {e}")
+
+    threading.Thread(target=run, daemon=True).start()
+    return stop
+
+
+def main(argv):
+    """Command line entry point: list, verify or restore snapshots"""
+    if len(argv) < 1 or argv[0] not in ('list', 'verify', 'restore'):
+        print("Usage: python snapshots.py list [store file]")
+        print("       python snapshots.py verify|restore <name> [store file]")
+        return 2
+
+    command = argv[0]
+    if command == 'list':
+        filename = argv[1] if len(argv) > 1 else DEFAULT_URLS_FILE
+        for name in list_snapshots(filename):
+            print(name)
+        return 0
+
+    if len(argv) < 2:
+        print(f"Usage: python snapshots.py {command} <name> [store file]")
+        return 2
+    name = argv[1]
+    filename = argv[2] if len(argv) > 2 else DEFAULT_URLS_FILE
+
+    if command == 'verify':
+        problems = verify_snapshot(filename, name)
+        for problem in problems:
+            print(f"[ERROR] {problem}")
+        if problems:
+            return 1
+        print(f"{name}: OK")
+    else:
+        restore_snapshot(filename, name)
+        print(f"Restored {filename} from {name}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
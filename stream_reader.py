@@ -0,0 +1,276 @@
+import heapq
+import json
+import os
+import sys
+from collections import Counter
+
+from click_archive import ArchiveBuilder, ClickArchive, archive_cutoff, archive_dir_for
+
+CHUNK_SIZE = 64 * 1024
+
+# A single value (one click record, one URL) larger than this means a corrupt file
+MAX_VALUE_SIZE = 16 * 1024 * 1024
+
+# Clicks written to the cold archive per segment append during a migration
+MIGRATE_BATCH_SIZE = 10000
+
+WHITESPACE = ' \t\n\r'
+
+
+class StoreReader:
+    """Incremental parser for shortened_urls.json that runs in constant memory.
+
+    Only the structure the server writes is parsed by hand: the top-level
+    object of links, each link object and its ``clicks`` array. Every other
+    value (each click record, strings, legacy integer click counts) is
+    small and decoded with the stdlib JSON decoder as the buffer reaches it.
+    """
+
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self.file = open(path, 'r')
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fill(self):
+        """Read another chunk, dropping the part of the buffer already parsed"""
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at end of file"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r} near offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if len(self.buf) - self.pos <= MAX_VALUE_SIZE and self.fill():
+                    continue
+                raise
+            # A number or literal ending exactly at the buffer edge may continue in the next chunk
+            if end == len(self.buf) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def separator(self, closing):
+        """Consume a ',' and return True, or the closing bracket and return False"""
+        char = self.peek()
+        self.pos += 1
+        if char == ',':
+            return True
+        if char == closing:
+            return False
+        raise ValueError(f"Expected ',' or {closing!r} but found {char!r}")
+
+    def records(self):
+        """Yield ('click', code, click) and ('link', code, link) events.
+
+        A link's click events come before its link event. The link dict
+        holds every field except the clicks, plus 'click_count'; legacy
+        links whose clicks are an integer yield no click events and report
+        that integer as 'click_count' with 'legacy_clicks' set.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            code = self.value()
+            self.expect(':')
+            self.expect('{')
+            link = {}
+            count = 0
+
+            if self.peek() == '}':
+                self.pos += 1
+            else:
+                while True:
+                    key = self.value()
+                    self.expect(':')
+                    if key == 'clicks' and self.peek() == '[':
+                        self.pos += 1
+                        if self.peek() == ']':
+                            self.pos += 1
+                        else:
+                            while True:
+                                yield 'click', code, self.value()
+                                count += 1
+                                if not self.separator(']'):
+                                    break
+                    elif key == 'clicks':
+                        legacy = self.value()
+                        count = legacy if isinstance(legacy, int) else 0
+                        link['legacy_clicks'] = True
+                    else:
+                        link[key] = self.value()
+                    if not self.separator('}'):
+                        break
+
+            link['click_count'] = count
+            yield 'link', code, link
+
+            if not self.separator('}'):
+                break
+
+
+def iter_records(path):
+    """Yield the click and link events of a store file, see StoreReader.records"""
+    with StoreReader(path) as reader:
+        yield from reader.records()
+
+
+def report(path, top=10):
+    """Summarize a store file without loading it"""
+    links = 0
+    legacy_links = 0
+    clicks = 0
+    first_click = None
+    last_click = None
+    devices = {'os': Counter(), 'browser': Counter(), 'type': Counter()}
+    countries = Counter()
+    top_links = []
+
+    for kind, code, record in iter_records(path):
+        if kind == 'click':
+            timestamp = record.get('timestamp')
+            if timestamp:
+                first_click = min(first_click or timestamp, timestamp)
+                last_click = max(last_click or timestamp, timestamp)
+            device = record.get('device') or {}
+            for dimension, counter in devices.items():
+                counter[device.get(dimension, 'Unknown')] += 1
+            location = record.get('location') or {}
+            countries[location.get('country', 'Unknown')] += 1
+            continue
+
+        links += 1
+        clicks += record['click_count']
+        if record.get('legacy_clicks'):
+            legacy_links += 1
+        entry = (record['click_count'], code, record.get('original_url'))
+        if len(top_links) < top:
+            heapq.heappush(top_links, entry)
+        else:
+            heapq.heappushpop(top_links, entry)
+
+    return {
+        'links': links,
+        'legacy_links': legacy_links,
+        'clicks': clicks,
+        'first_click': first_click,
+        'last_click': last_click,
+        'devices': {dimension: dict(counter.most_common()) for dimension, counter in devices.items()},
+        'countries': dict(countries.most_common(top)),
+        'top_links': [
+            {'short_code': code, 'original_url': url, 'clicks': count}
+            for count, code, url in sorted(top_links, reverse=True)
+        ]
+    }
+
+
+def migrate(source, destination=None, cutoff=None):
+    """Rewrite a store file into the current layout in constant memory.
+
+    Legacy integer click counts become empty click lists (as expand()
+    does), clicks older than the archive cutoff go straight to the cold
+    archive next to the destination, and the remaining store is written
+    compactly and renamed into place. Only one link's recent clicks are
+    held in memory at a time; the archive index is built on disk by an
+    ArchiveBuilder and written once at the end.
+    """
+    destination = destination or source
+    cutoff = cutoff or archive_cutoff()
+    archive = ClickArchive(archive_dir_for(destination))
+    builder = ArchiveBuilder(archive, MIGRATE_BATCH_SIZE)
+    tmp_path = destination + '.migrate'
+
+    hot = []
+    stats = {'links': 0, 'archived': 0, 'hot': 0, 'legacy_links': 0}
+
+    with open(tmp_path, 'w') as out:
+        out.write('{')
+        for kind, code, record in iter_records(source):
+            if kind == 'click':
+                watermark = archive.watermark(code) or ''
+                if record['timestamp'] >= cutoff:
+                    hot.append(record)
+                elif record['timestamp'] > watermark:
+                    builder.add(code, record)
+                continue
+
+            if record.pop('legacy_clicks', False):
+                stats['legacy_links'] += 1
+            record.pop('click_count')
+            record['clicks'] = hot
+            out.write(',\n' if stats['links'] else '\n')
+            out.write(json.dumps(code) + ': ' + json.dumps(record))
+            stats['links'] += 1
+            stats['hot'] += len(hot)
+            hot = []
+
+        out.write('\n}\n')
+        out.flush()
+        os.fsync(out.fileno())
+
+    # Archive first so a crash can only leave clicks in both tiers, which
+    # readers drop from the hot tier by watermark
+    builder.close()
+    stats['archived'] = builder.archived
+    os.replace(tmp_path, destination)
+    return stats
+
+
+def main(argv):
+    """Command line entry point: report on or migrate a store file"""
+    if len(argv) < 2 or argv[0] not in ('report', 'migrate'):
+        print("Usage: python stream_reader.py report <store file>")
+        print("       python stream_reader.py migrate <store file> [destination]")
+        return 2
+
+    if argv[0] == 'report':
+        print(json.dumps(report(argv[1]), indent=2))
+    else:
+        stats = migrate(argv[1], argv[2] if len(argv) > 2 else None)
+        print(f"Migrated {stats['links']} links ({stats['legacy_links']} legacy): "
+              f"{stats['hot']} recent clicks kept, {stats['archived']} archived")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,169 @@
+import multiprocessing
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+import shared_table
+from shared_table import INITIAL_CAPACITY, SharedLinkTable, TableBusy, fcntl
+
+# Links present before the readers start, and links the writer adds while they run
+PRELOADED = 200
+ADDED = 3000
+
+
+def url_for(code):
+    return f"https://example.com/{code}/" + 'x' * (len(code) % 7)
+
+
+def read_until_stopped(path, ready, stop, results):
+    """Look up every preloaded code and any added code until told to stop.
+
+    Puts (lookups, problems) on the results queue, where problems lists
+    every lookup that returned a wrong URL or lost a preloaded code.
+    """
+    table = SharedLinkTable(path)
+    ready.put(True)
+    lookups = 0
+    problems = []
+    while not stop.is_set():
+        for i in range(PRELOADED):
+            code = f"pre{i}"
+            url = table.lookup(code)
+            lookups += 1
+            if url != url_for(code):
+                problems.append((code, url))
+        for i in range(0, ADDED, 97):
+            code = f"new{i}"
+            url = table.lookup(code)
+            lookups += 1
+            if url is not None and url != url_for(code):
+                problems.append((code, url))
+    table.close()
+    results.put((lookups, problems[:10]))
+
+
+@unittest.skipIf(fcntl is None, "the shared link table needs fcntl")
+class SharedLinkTableTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'links.table')
+        self.table = SharedLinkTable(self.path, writable=True)
+        self.table.load({f"pre{i}": {'original_url': url_for(f"pre{i}")} for i in range(PRELOADED)})
+
+    def tearDown(self):
+        self.table.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def add_links(self):
+        for i in range(ADDED):
+            self.table.put(f"new{i}", url_for(f"new{i}"))
+
+    def test_put_remove_lookup(self):
+        self.table.put('a', 'https://a.example')
+        self.table.put('a', 'https://b.example')
+        self.assertEqual(self.table.lookup('a'), 'https://b.example')
+        self.assertTrue(self.table.remove('a'))
+        self.assertIsNone(self.table.lookup('a'))
+        self.assertFalse(self.table.remove('a'))
+        self.assertEqual(self.table.lookup('pre0'), url_for('pre0'))
+
+    def test_destinations(self):
+        self.table.put('w', 'https://a.example', [('https://a.example', 1), ('https://b.example', 2.5)])
+        reader = SharedLinkTable(self.path)
+        self.assertEqual(reader.get('w'), ('https://a.example', [('https://a.example', 1), ('https://b.example', 2.5)]))
+        self.assertEqual(reader.get('pre0'), (url_for('pre0'), None))
+        self.assertEqual(reader.get('missing'), (None, None))
+        reader.close()
+
+        self.table.load({'w': {
+            'original_url': 'https://a.example',
+            'destinations': [{'url': 'https://a.example', 'weight': 3, 'hits': 7}]
+        }})
+        self.assertEqual(self.table.get('w'), ('https://a.example', [('https://a.example', 3)]))
+        self.assertIsNone(self.table.lookup('pre0'))
+
+    def test_single_writer(self):
+        with self.assertRaises(RuntimeError):
+            SharedLinkTable(self.path, writable=True)
+        self.table.close()
+        writer = SharedLinkTable(self.path, writable=True)
+        self.assertEqual(writer.lookup('pre0'), url_for('pre0'))
+        self.table = writer
+
+    def test_reader_gives_up_on_a_stuck_slot(self):
+        index, _ = self.table.find(b'pre0')
+        position = self.table.slot_position(index)
+        seq = struct.unpack_from('<I', self.table.map, position)[0]
+        # Leave the slot looking mid-update, as a writer that died would
+        struct.pack_into('<I', self.table.map, position, seq + 1)
+        reader = SharedLinkTable(self.path)
+        started = time.monotonic()
+        with self.assertRaises(TableBusy):
+            reader.lookup('pre0')
+        self.assertLess(time.monotonic() - started, shared_table.READ_TIMEOUT + 1)
+        struct.pack_into('<I', self.table.map, position, seq)
+        self.assertEqual(reader.lookup('pre0'), url_for('pre0'))
+        reader.close()
+
+    def test_readers_in_other_processes_during_put_and_grow(self):
+        context = multiprocessing.get_context('spawn')
+        ready = context.Queue()
+        stop = context.Event()
+        results = context.Queue()
+        readers = [
+            context.Process(target=read_until_stopped, args=(self.path, ready, stop, results))
+            for _ in range(2)
+        ]
+        for reader in readers:
+            reader.start()
+        for _ in readers:
+            ready.get(timeout=60)
+
+        self.add_links()
+        stop.set()
+        outcomes = [results.get(timeout=60) for _ in readers]
+        for reader in readers:
+            reader.join(timeout=60)
+
+        self.assertGreater(self.table.capacity, INITIAL_CAPACITY)
+        for lookups, problems in outcomes:
+            self.assertGreater(lookups, 0)
+            self.assertEqual(problems, [])
+
+        reader = SharedLinkTable(self.path)
+        self.assertEqual(reader.lookup(f"new{ADDED - 1}"), url_for(f"new{ADDED - 1}"))
+        reader.close()
+
+    def test_threads_sharing_the_writer_during_put_and_grow(self):
+        stop = threading.Event()
+        problems = []
+
+        def read():
+            while not stop.is_set():
+                for i in range(PRELOADED):
+                    code = f"pre{i}"
+                    url = self.table.lookup(code)
+                    if url != url_for(code):
+                        problems.append((code, url))
+
+        readers = [threading.Thread(target=read) for _ in range(2)]
+        for reader in readers:
+            reader.start()
+        try:
+            self.add_links()
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+
+        self.assertGreater(self.table.capacity, INITIAL_CAPACITY)
+        self.assertEqual(problems, [])
+        self.assertEqual(self.table.get_metrics()['links'], PRELOADED + ADDED)
+
+
+if __name__ == '__main__':
+    unittest.main()
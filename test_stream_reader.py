@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import click_archive
+import stream_reader
+from click_archive import ClickArchive, archive_dir_for
+from stream_reader import StoreReader, migrate
+
+CUTOFF = '2026-01-01T00:00:00'
+
+
+def click(timestamp, os_name='Linux'):
+    return {
+        'timestamp': timestamp,
+        'device': {'os': os_name, 'browser': 'Firefox', 'type': 'Desktop'},
+        'ip': '127.0.0.1',
+        'location': {'country': 'Café "Land"', 'city': 'a\\b'}
+    }
+
+
+def sample_store():
+    """Links with old and recent clicks, an empty one and a legacy integer count"""
+    return {
+        'happy-cat': {
+            'original_url': 'https://example.com/a?q=1,2',
+            'created_at': '2025-06-01T10:00:00',
+            'clicks': [
+                click('2025-06-02T10:00:00'),
+                click('2025-06-02T11:30:00.123456', 'Android'),
+                click('2025-07-15T09:00:00'),
+                click('2026-02-01T08:00:00', 'iOS')
+            ]
+        },
+        'quiet-fox': {
+            'original_url': 'https://example.org/über',
+            'created_at': '2025-06-03T00:00:00',
+            'clicks': []
+        },
+        'old-link': {
+            'original_url': 'https://example.net/',
+            'created_at': '2024-01-01T00:00:00',
+            'clicks': 42
+        },
+        'bold-wolf': {
+            'original_url': 'https://example.com/b',
+            'created_at': '2025-06-01T12:00:00',
+            'clicks': [click('2025-06-02T12:00:00'), click('2026-03-01T00:00:00')]
+        }
+    }
+
+
+def read_all(path, chunk_size=stream_reader.CHUNK_SIZE):
+    with StoreReader(path, chunk_size) as reader:
+        return list(reader.records())
+
+
+class StoreReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'urls.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def rebuild(self, events):
+        """Turn reader events back into the store they came from"""
+        store = {}
+        clicks = {}
+        for kind, code, record in events:
+            if kind == 'click':
+                clicks.setdefault(code, []).append(record)
+                continue
+            count = record.pop('click_count')
+            if record.pop('legacy_clicks', False):
+                record['clicks'] = count
+            else:
+                record['clicks'] = clicks.get(code, [])
+                self.assertEqual(count, len(record['clicks']))
+            store[code] = record
+        return store
+
+    def test_small_chunk_sizes(self):
+        store = sample_store()
+        for indent in (None, 2):
+            self.write(json.dumps(store, indent=indent))
+            for chunk_size in (1, 2, 7, 64 * 1024):
+                with self.subTest(indent=indent, chunk_size=chunk_size):
+                    self.assertEqual(self.rebuild(read_all(self.path, chunk_size)), store)
+
+    def test_legacy_integer_clicks(self):
+        self.write(json.dumps({'old-link': sample_store()['old-link']}))
+        events = read_all(self.path, 3)
+        self.assertEqual(len(events), 1)
+        kind, code, link = events[0]
+        self.assertEqual((kind, code), ('link', 'old-link'))
+        self.assertEqual(link['click_count'], 42)
+        self.assertTrue(link['legacy_clicks'])
+        self.assertNotIn('clicks', link)
+
+    def test_empty_store(self):
+        self.write(' {\n}\n')
+        self.assertEqual(read_all(self.path, 1), [])
+
+    def test_empty_file(self):
+        self.write('')
+        with self.assertRaises(ValueError):
+            read_all(self.path)
+
+    def test_truncated_file(self):
+        text = json.dumps(sample_store(), indent=2)
+        for end in (1, 10, len(text) // 3, len(text) // 2, len(text) - 3, len(text) - 1):
+            self.write(text[:end])
+            for chunk_size in (1, 7, 64 * 1024):
+                with self.subTest(end=end, chunk_size=chunk_size):
+                    with self.assertRaises(ValueError):
+                        read_all(self.path, chunk_size)
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'urls.json')
+        with open(self.path, 'w') as f:
+            json.dump(sample_store(), f, indent=2)
+        # Tiny batches so segment appends and index spills happen mid-run
+        patches = [
+            mock.patch.object(stream_reader, 'MIGRATE_BATCH_SIZE', 2),
+            mock.patch.object(click_archive, 'SPILL_BATCH_SIZE', 3)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_migrate(self):
+        stats = migrate(self.path, cutoff=CUTOFF)
+        self.assertEqual(stats, {'links': 4, 'archived': 4, 'hot': 2, 'legacy_links': 1})
+
+        with open(self.path, 'r') as f:
+            store = json.load(f)
+        self.assertEqual(store['old-link']['clicks'], [])
+        self.assertEqual([c['timestamp'] for c in store['happy-cat']['clicks']], ['2026-02-01T08:00:00'])
+        self.assertEqual([c['timestamp'] for c in store['bold-wolf']['clicks']], ['2026-03-01T00:00:00'])
+
+        archive = ClickArchive(archive_dir_for(self.path))
+        self.assertEqual(archive.click_count('happy-cat'), 3)
+        self.assertEqual(archive.click_count('bold-wolf'), 1)
+        self.assertEqual(archive.watermark('happy-cat'), '2025-07-15T09:00:00')
+        self.assertEqual(sample_store()['happy-cat']['clicks'][:3], archive.get_clicks('happy-cat'))
+        self.assertEqual(archive.index['segments']['20250602']['count'], 3)
+        self.assertFalse(os.path.exists(os.path.join(archive.directory, 'build.tmp')))
+
+    def test_migrate_merges_with_existing_archive(self):
+        migrate(self.path, cutoff=CUTOFF)
+        # The same old clicks again: already archived, so they are dropped
+        with open(self.path, 'w') as f:
+            json.dump(sample_store(), f)
+        stats = migrate(self.path, cutoff=CUTOFF)
+        self.assertEqual(stats['archived'], 0)
+
+        archive = ClickArchive(archive_dir_for(self.path))
+        self.assertEqual(archive.click_count('happy-cat'), 3)
+        self.assertEqual(len(archive.get_clicks('happy-cat')), 3)
+        self.assertEqual(archive.watermark('bold-wolf'), '2025-06-02T12:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
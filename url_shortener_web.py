@@ -1,14 +1,28 @@
 import json
+import math
 import os
 import random
 import webbrowser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
 from datetime import datetime
 import threading
 import socket
+import time
 import urllib.request
 
+from click_archive import ClickArchive, archive_cutoff, archive_dir_for
+from admission import AdmissionController, request_priority
+from alias_table import AliasTable
+from analytics import DIMENSIONS, ClickColumns
+from bloom_filter import BloomFilter
+from namespaces import NAMESPACES_DIR, NamespaceManager
+from redirects import client_ip, send_not_found, send_redirect
+from search_index import SearchIndex
+from redirect_worker import start_redirect_workers
+from shared_table import SharedLinkTable, link_destinations, shared_table_path_for
+from snapshots import list_snapshots, start_snapshot_schedule, take_snapshot
+
 # Get local IP address
 def get_local_ip():
     """Get the local IP address of the machine"""
@@ -90,22 +104,162 @@ NOUNS = [
     'mountain', 'river', 'forest', 'ocean', 'storm', 'flame', 'shadow', 'star'
 ]
 
+# How often (in seconds) old clicks are moved to the cold archive
+ARCHIVE_INTERVAL = 3600
+
+# Rough in-memory cost of a loaded store, measured with tracemalloc: a fixed
+# overhead, the parsed JSON per byte of store file, the search index per link,
+# alias tables per weighted destination and analytics columns per click row
+STORE_BASE_BYTES = 8 * 1024
+STORE_BYTES_PER_FILE_BYTE = 3
+SEARCH_INDEX_BYTES_PER_LINK = 13000
+ALIAS_TABLE_BYTES_PER_DESTINATION = 40
+ANALYTICS_BYTES_PER_ROW = 18
+
+# Target false-positive rate of the filter that short-circuits unknown codes
+CODE_FILTER_FP_RATE = float(os.environ.get('SHORTENER_FILTER_FP_RATE', '0.01'))
+
+# Rebuild the code filter once this fraction of its capacity are deleted codes
+CODE_FILTER_STALE_RATIO = 0.25
+
+# Pre-forked processes that answer /r/ requests from the shared link table
+# and hand everything else to this one
+REDIRECT_WORKERS = int(os.environ.get('SHORTENER_WORKERS', '0'))
+
+# Keep an mmap'd code -> URL table that other processes read; needed by workers
+SHARED_TABLE_ENABLED = os.environ.get('SHORTENER_SHARED_TABLE', '') == '1' or REDIRECT_WORKERS > 0
+
+# Links, or archived clicks, handled per acquisition of the store lock while
+# building analytics columns
+ANALYTICS_BUILD_BATCH_SIZE = 1000
+
+# Largest number of weighted destinations one short code can split traffic across
+MAX_DESTINATIONS = 100
+
+# Largest number of operations accepted in one /api/batch request
+MAX_BATCH_OPERATIONS = 10000
+
+# Response body for requests shed under overload, built once
+OVERLOADED_BODY = json.dumps({'success': False, 'message': 'Server overloaded, retry shortly'}).encode()
+
+def batch_operation_error(operation):
+    """Check the shape of one /api/batch operation, returning an error message or None"""
+    if not isinstance(operation, dict) or operation.get('op') not in ('shorten', 'delete', 'set_destinations'):
+        return 'Unknown operation'
+    for field in ('url', 'code'):
+        if operation.get(field) is not None and not isinstance(operation[field], str):
+            return f"'{field}' must be a string"
+    if operation['op'] == 'set_destinations':
+        destinations = operation.get('destinations')
+        if not isinstance(destinations, list) or not all(
+                isinstance(d, dict) and isinstance(d.get('url'), str) for d in destinations):
+            return "Invalid destinations: expected a list of {'url': ..., 'weight': ...}"
+    return None
+
+class ArchiveScheduler:
+    """Runs archive passes for every registered store on one daemon thread"""
+    
+    def __init__(self, interval=ARCHIVE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stores = []
+        self.thread = None
+    
+    def register(self, store):
+        with self.lock:
+            self.stores.append(store)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+    
+    def unregister(self, store):
+        with self.lock:
+            if store in self.stores:
+                self.stores.remove(store)
+    
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                stores = list(self.stores)
+            for store in stores:
+                try:
+                    store.archive_clicks()
+                    store.archive.flush()
+                except Exception as e:
+                    print(f"[ERROR] Scheduled archive pass failed for {store.filename}: {e}")
+
+archive_scheduler = ArchiveScheduler()
+
 class URLShortener:
     def __init__(self, filename=URLS_FILE):
         self.filename = filename
+        # Guards every mutation of urls so batches apply atomically
+        self.lock = threading.RLock()
+        self.archive = ClickArchive(archive_dir_for(filename))
+        self.search_index = SearchIndex()
+        self.analytics = None
+        # Columns being built by build_analytics; one build at a time
+        self.analytics_building = None
+        self.analytics_lock = threading.Lock()
+        # Alias tables for weighted links, rebuilt only when their weights change
+        self.alias_tables = {}
+        self.filter_metrics = {
+            'lookups': 0,
+            'definite_misses': 0,
+            'false_positives': 0,
+            'rebuilds': 0,
+            'rebuild_ms': 0.0,
+            'stale': 0
+        }
         self.urls = self.load_urls()
+        self.shared_table = None
+        if SHARED_TABLE_ENABLED:
+            # This process is the table's only writer, so it starts from the store file
+            self.shared_table = SharedLinkTable(shared_table_path_for(filename), writable=True)
+            self.shared_table.load(self.urls)
+        # Snapshots still copying links, see preserve()
+        self.captures = []
+        # Bumped whenever an archive pass trims hot click lists
+        self.archive_generation = 0
+        self.archive_clicks()
+        archive_scheduler.register(self)
     
     def load_urls(self):
         """Load URL mappings from file"""
         if os.path.exists(self.filename):
             with open(self.filename, 'r') as f:
-                return json.load(f)
+                urls = json.load(f)
+            self.search_index.rebuild(urls)
+            self.rebuild_code_filter(urls)
+            return urls
+        self.search_index.rebuild({})
+        self.rebuild_code_filter({})
         return {}
     
     def save_urls(self):
         """Save URL mappings to file"""
-        with open(self.filename, 'w') as f:
-            json.dump(self.urls, f, indent=2)
+        # Write to a temporary file and rename it so readers never see a torn file
+        tmp_filename = self.filename + '.tmp'
+        with self.lock:
+            with open(tmp_filename, 'w') as f:
+                json.dump(self.urls, f, indent=2)
+            os.replace(tmp_filename, self.filename)
+    
+    def rebuild_code_filter(self, urls=None):
+        """Rebuild the Bloom filter of existing short codes"""
+        urls = self.urls if urls is None else urls
+        started = time.perf_counter()
+        
+        # Leave headroom so new links don't force a rebuild straight away
+        code_filter = BloomFilter(max(len(urls) * 2, 1024), CODE_FILTER_FP_RATE)
+        for code in urls:
+            code_filter.add(code)
+        self.code_filter = code_filter
+        
+        self.filter_metrics['rebuilds'] += 1
+        self.filter_metrics['rebuild_ms'] = (time.perf_counter() - started) * 1000
+        self.filter_metrics['stale'] = 0
     
     def generate_short_code(self):
         """Generate a random short code using adjective + noun"""
@@ -114,58 +268,187 @@ class URLShortener:
         code = f"{adjective}-{noun}"
         
         # If code already exists, regenerate
+        attempts = 1
         while code in self.urls:
             adjective = random.choice(ADJECTIVES)
             noun = random.choice(NOUNS)
             code = f"{adjective}-{noun}"
+            
+            # Once the word pairs are mostly used up (e.g. by a bulk batch), add a number
+            attempts += 1
+            if attempts > len(ADJECTIVES) * len(NOUNS):
+                code = f"{code}-{random.randint(2, 9999)}"
         
         return code
     
-    def shorten(self, original_url):
-        """Shorten a URL and return the short code"""
-        # Check if URL already exists
-        for code, data in self.urls.items():
-            if data['original_url'] == original_url:
-                return code
-        
-        # Generate new short code
-        short_code = self.generate_short_code()
-        
-        # Store the mapping
-        self.urls[short_code] = {
-            'original_url': original_url,
-            'created_at': datetime.now().isoformat(),
-            'clicks': []
-        }
+    def shorten(self, original_url, custom_code=None, save=True):
+        """Shorten a URL and return the short code.
         
-        self.save_urls()
-        return short_code
+        Returns None if a custom vanity code was requested but is invalid or taken.
+        """
+        with self.lock:
+            if custom_code:
+                if not self.search_index.is_available(custom_code):
+                    return None
+                short_code = custom_code
+            else:
+                # Check if URL already exists
+                existing_code = self.search_index.find_url(original_url)
+                if existing_code is not None:
+                    return existing_code
+                
+                # Generate new short code
+                short_code = self.generate_short_code()
+            
+            # Store the mapping
+            self.urls[short_code] = {
+                'original_url': original_url,
+                'created_at': datetime.now().isoformat(),
+                'clicks': []
+            }
+            self.search_index.add(short_code, original_url)
+            if self.shared_table is not None:
+                self.shared_table.put(short_code, original_url)
+            self.code_filter.add(short_code)
+            if self.code_filter.count > self.code_filter.capacity:
+                self.rebuild_code_filter()
+            
+            if save:
+                self.save_urls()
+            return short_code
     
     def expand(self, short_code, user_agent='Unknown', user_ip='Unknown'):
         """Expand a short code back to the original URL and record click"""
+        # Definite misses never reach the store
+        self.filter_metrics['lookups'] += 1
+        if not self.code_filter.might_contain(short_code):
+            self.filter_metrics['definite_misses'] += 1
+            return None
+        
         if short_code in self.urls:
+            # Get geolocation data
+            location_info = get_geolocation(user_ip)
+            return self.record_click(short_code, self.click_record(user_agent, user_ip, location_info))
+        
+        self.filter_metrics['false_positives'] += 1
+        return None
+    
+    def click_record(self, user_agent, user_ip, location_info, timestamp=None):
+        """Build a click record with device info and location"""
+        # Parse user agent to get device info
+        device_info = self.parse_user_agent(user_agent)
+        
+        # Record the click with timestamp, device info, IP, and location
+        return {
+            'timestamp': timestamp or datetime.now().isoformat(),
+            'device': device_info,
+            'ip': user_ip,
+            'location': location_info
+        }
+    
+    def record_click(self, short_code, click_record, destination_url=None, save=True):
+        """Record a click and return the URL it goes to, or None if the link is gone.
+        
+        For a weighted link, destination_url is the destination a redirect
+        worker already sent the visitor to; without it (or if it is no
+        longer one of the link's destinations) one is picked here.
+        """
+        with self.lock:
+            data = self.urls.get(short_code)
+            if data is None:
+                # Deleted while the click was being looked up
+                return None
+            
+            self.preserve(short_code)
+            
             # Convert old format (integer clicks) to new format (list of click records)
-            if isinstance(self.urls[short_code]['clicks'], int):
-                self.urls[short_code]['clicks'] = []
+            if isinstance(data['clicks'], int):
+                data['clicks'] = []
             
-            # Parse user agent to get device info
-            device_info = self.parse_user_agent(user_agent)
+            if 'destinations' in data:
+                destinations = data['destinations']
+                destination = next((d for d in destinations if d['url'] == destination_url), None)
+                if destination is None:
+                    destination = destinations[self.alias_table(short_code).pick()]
+                destination['hits'] += 1
+                destination_url = destination['url']
+                click_record['destination'] = destination_url
+            else:
+                destination_url = data['original_url']
             
-            # Get geolocation data
-            location_info = get_geolocation(user_ip)
+            data['clicks'].append(click_record)
+            if self.analytics is not None:
+                self.analytics.add_click(short_code, click_record)
+            elif self.analytics_building is not None:
+                self.analytics_building.add_live_click(short_code, click_record)
+            if save:
+                self.save_urls()
+            return destination_url
+    
+    def preserve(self, short_code):
+        """Let snapshots that are still capturing copy a link before it changes.
+        
+        Call with the lock held, before changing anything in the link's dict.
+        """
+        for capture in self.captures:
+            capture.preserve(short_code)
+    
+    def alias_table(self, short_code):
+        """Get the cached alias table for a weighted link, building it if needed"""
+        table = self.alias_tables.get(short_code)
+        if table is None:
+            weights = [destination['weight'] for destination in self.urls[short_code]['destinations']]
+            table = self.alias_tables[short_code] = AliasTable(weights)
+        return table
+    
+    def set_destinations(self, short_code, destinations, save=True):
+        """Split a short code's traffic across weighted destinations.
+        
+        destinations is a list of (url, weight) pairs; a single pair turns the
+        link back into a plain one. Hit counters of URLs that stay in the set
+        are kept. Returns False if the short code doesn't exist and raises
+        ValueError for an invalid destination list.
+        """
+        if not destinations or len(destinations) > MAX_DESTINATIONS:
+            raise ValueError(f"Expected between 1 and {MAX_DESTINATIONS} destinations")
+        for url, weight in destinations:
+            if not url or not isinstance(weight, (int, float)) or not (weight > 0 and math.isfinite(weight)):
+                raise ValueError("Every destination needs a URL and a positive, finite weight")
+        if not math.isfinite(sum(weight for _, weight in destinations)):
+            raise ValueError("Destination weights are too large to add up")
+        
+        with self.lock:
+            data = self.urls.get(short_code)
+            if data is None:
+                return False
+            self.preserve(short_code)
             
-            # Record the click with timestamp, device info, IP, and location
-            click_record = {
-                'timestamp': datetime.now().isoformat(),
-                'device': device_info,
-                'ip': user_ip,
-                'location': location_info
-            }
+            hits = {destination['url']: destination['hits'] for destination in data.get('destinations', [])}
+            data['original_url'] = destinations[0][0]
+            if len(destinations) == 1:
+                data.pop('destinations', None)
+            else:
+                # Replace rather than mutate the list so snapshots keep the old one
+                data['destinations'] = [
+                    {'url': url, 'weight': weight, 'hits': hits.get(url, 0)}
+                    for url, weight in destinations
+                ]
+            self.alias_tables.pop(short_code, None)
+            self.search_index.add(short_code, data['original_url'], weighted='destinations' in data)
+            if self.shared_table is not None:
+                self.shared_table.put(short_code, data['original_url'], link_destinations(data))
             
-            self.urls[short_code]['clicks'].append(click_record)
-            self.save_urls()
-            return self.urls[short_code]['original_url']
-        return None
+            if save:
+                self.save_urls()
+            return True
+    
+    def get_destinations(self, short_code):
+        """Copy a link's weighted destinations with their hits ([] for a plain link, None if missing)"""
+        with self.lock:
+            data = self.urls.get(short_code)
+            if data is None:
+                return None
+            return [dict(destination) for destination in data.get('destinations', [])]
     
     def parse_user_agent(self, user_agent):
         """Extract device information from user agent"""
@@ -211,152 +494,367 @@ class URLShortener:
             'type': device_type
         }
     
-    def get_stats(self, short_code):
+    def archive_clicks(self, cutoff=None):
+        """Move clicks older than the cutoff from the hot store to the cold archive"""
+        cutoff = cutoff or archive_cutoff()
+        records = []
+        stale_codes = []
+        
+        # Only collect under the lock; compressing and fsyncing the archive
+        # happens without it so redirects keep flowing
+        with self.lock:
+            for code, data in self.urls.items():
+                clicks = data['clicks']
+                if not isinstance(clicks, list) or not clicks:
+                    continue
+                
+                watermark = self.archive.watermark(code) or ''
+                old = 0
+                for click in clicks:
+                    if click['timestamp'] < cutoff:
+                        old += 1
+                        if click['timestamp'] > watermark:
+                            # Clicks at or before the watermark were already archived
+                            # by a pass that crashed before the hot store was saved
+                            records.append((code, click))
+                if old:
+                    stale_codes.append(code)
+        
+        # Archive first so a crash can only leave duplicates in the hot
+        # store, which the watermark check above drops on the next pass
+        if records:
+            self.archive.append(records)
+        if not stale_codes:
+            return False
+        
+        with self.lock:
+            self.archive_generation += 1
+            for code in stale_codes:
+                data = self.urls.get(code)
+                if data is not None and isinstance(data['clicks'], list):
+                    self.preserve(code)
+                    # Swap in a new list; snapshots rely on click lists only growing
+                    data['clicks'] = [click for click in data['clicks'] if click['timestamp'] >= cutoff]
+            self.save_urls()
+        return True
+    
+    def close(self, save=True):
+        """Leave the archive schedule and flush the store and archive index to disk"""
+        archive_scheduler.unregister(self)
+        if save:
+            self.save_urls()
+            self.archive.flush()
+        if self.shared_table is not None:
+            self.shared_table.close()
+    
+    def estimate_memory(self):
+        """Estimate the bytes this store holds in memory, without taking its lock"""
+        try:
+            file_size = os.path.getsize(self.filename)
+        except OSError:
+            file_size = 0
+        analytics = self.analytics
+        return (STORE_BASE_BYTES
+                + file_size * STORE_BYTES_PER_FILE_BYTE
+                + len(self.code_filter.bits)
+                + len(self.urls) * SEARCH_INDEX_BYTES_PER_LINK
+                + sum(table.size for table in list(self.alias_tables.values())) * ALIAS_TABLE_BYTES_PER_DESTINATION
+                + (len(analytics) * ANALYTICS_BYTES_PER_ROW if analytics is not None else 0))
+    
+    def get_clicks(self, short_code, since=None, until=None):
+        """Get click records from both the cold and hot tiers, oldest first"""
+        # Take the hot list before the archive view: an archive pass swaps in
+        # a trimmed list, but this one keeps every click not yet in the view
+        with self.lock:
+            data = self.urls.get(short_code)
+            if data is None:
+                return None
+            hot = data['clicks'] if isinstance(data['clicks'], list) else []
+        
+        # Ignore archived clicks of an earlier link that reused this code
+        if since is None or since < data['created_at']:
+            since = data['created_at']
+        
+        segments, watermarks = self.archive.view(short_code, since, until)
+        clicks = self.archive.get_clicks(short_code, since, until, segments)
+        watermark = watermarks.get(short_code, '')
+        for click in hot:
+            # Clicks at or before the watermark were read from the cold tier
+            if click['timestamp'] < since or click['timestamp'] <= watermark:
+                continue
+            if until is not None and click['timestamp'] > until:
+                continue
+            clicks.append(click)
+        return clicks
+    
+    def get_stats(self, short_code, since=None, until=None):
         """Get statistics for a shortened URL"""
         if short_code in self.urls:
-            return self.urls[short_code]
+            return dict(self.urls[short_code], clicks=self.get_clicks(short_code, since, until))
         return None
     
     def list_all(self):
-        """List all shortened URLs"""
-        return self.urls
+        """List all shortened URLs with their full click history"""
+        while True:
+            with self.lock:
+                links = dict(self.urls)
+                generation = self.archive_generation
+            
+            # One pass over the cold tier instead of one per short code
+            segments, watermarks = self.archive.view()
+            archived = {}
+            for code, click in self.archive.iter_clicks(segments=segments):
+                data = links.get(code)
+                if data is not None and click['timestamp'] >= data['created_at']:
+                    archived.setdefault(code, []).append(click)
+            
+            result = {}
+            for code, data in links.items():
+                clicks = sorted(archived.get(code, []), key=lambda click: click['timestamp'])
+                # Hot clicks at or before the watermark were read from the cold tier
+                watermark = watermarks.get(code, '')
+                hot = data['clicks'] if isinstance(data['clicks'], list) else []
+                hot = [click for click in hot if click['timestamp'] > watermark]
+                result[code] = dict(data, clicks=clicks + hot)
+            
+            # An archive pass that trimmed hot lists meanwhile may have moved
+            # clicks out of both tiers as read here; read again
+            if self.archive_generation == generation:
+                return result
     
-    def delete(self, short_code):
+    def search(self, query=None, domain=None, offset=0, limit=20):
+        """Search short codes by code prefix, URL substring and/or domain.
+        
+        Returns the total number of matches and one page of results.
+        """
+        with self.lock:
+            codes = self.search_index.search(query, domain)
+            results = []
+            for code in codes[offset:offset + limit]:
+                data = self.urls[code]
+                clicks = data['clicks'] if isinstance(data['clicks'], list) else []
+                results.append({
+                    'short_code': code,
+                    'original_url': data['original_url'],
+                    'created_at': data['created_at'],
+                    'clicks': len(clicks) + self.archive.click_count(code)
+                })
+        return len(codes), results
+    
+    def get_analytics(self):
+        """Get the columnar click data, building it on first use"""
+        with self.analytics_lock:
+            if self.analytics is None:
+                self.build_analytics()
+        return self.analytics
+    
+    def build_analytics(self):
+        """Build the columnar click data while the store keeps serving.
+        
+        The store lock is only held for a batch of links or archived clicks
+        at a time. Hot clicks newer than each link's archive watermark are
+        read first, and from then on its new clicks go straight into the
+        columns; archived clicks up to that watermark are read last. A link
+        deleted (or replaced) meanwhile gets no archived clicks.
+        """
+        columns = ClickColumns()
+        with self.lock:
+            codes = list(self.urls)
+            columns.pending.update(codes)
+            self.analytics_building = columns
+        
+        try:
+            # code -> (created_at, watermark) of each link as its hot clicks were read
+            links = {}
+            for start in range(0, len(codes), ANALYTICS_BUILD_BATCH_SIZE):
+                with self.lock:
+                    for code in codes[start:start + ANALYTICS_BUILD_BATCH_SIZE]:
+                        columns.pending.discard(code)
+                        data = self.urls.get(code)
+                        if data is None:
+                            continue
+                        watermark = self.archive.watermark(code) or ''
+                        links[code] = (data['created_at'], watermark)
+                        if isinstance(data['clicks'], list):
+                            for click in data['clicks']:
+                                if click['timestamp'] > watermark:
+                                    columns.add_click(code, click)
+            
+            def add_archived(batch):
+                with self.lock:
+                    for code, click in batch:
+                        data = self.urls.get(code)
+                        if data is not None and data['created_at'] == links[code][0]:
+                            columns.add_click(code, click)
+            
+            # The view is taken after every watermark above, so it holds all
+            # clicks up to them
+            segments, _ = self.archive.view()
+            batch = []
+            for code, click in self.archive.iter_clicks(segments=segments):
+                link = links.get(code)
+                if link is not None and link[0] <= click['timestamp'] <= link[1]:
+                    batch.append((code, click))
+                    if len(batch) >= ANALYTICS_BUILD_BATCH_SIZE:
+                        add_archived(batch)
+                        batch = []
+            add_archived(batch)
+            
+            with self.lock:
+                self.analytics = columns
+        finally:
+            with self.lock:
+                self.analytics_building = None
+    
+    def get_metrics(self):
+        """Store size and code filter metrics"""
+        lookups = self.filter_metrics['lookups']
+        metrics = {
+            'links': len(self.urls),
+            'code_filter': dict(
+                self.filter_metrics,
+                capacity=self.code_filter.capacity,
+                size_bytes=len(self.code_filter.bits),
+                definite_miss_rate=self.filter_metrics['definite_misses'] / lookups if lookups else 0.0
+            )
+        }
+        if self.shared_table is not None:
+            metrics['shared_table'] = self.shared_table.get_metrics()
+        return metrics
+    
+    def is_code_available(self, short_code):
+        """Check whether a custom vanity code can be used"""
+        return self.search_index.is_available(short_code)
+    
+    def delete(self, short_code, save=True):
         """Delete a shortened URL"""
-        if short_code in self.urls:
-            del self.urls[short_code]
-            self.save_urls()
-            return True
-        return False
+        with self.lock:
+            if short_code in self.urls:
+                del self.urls[short_code]
+                self.alias_tables.pop(short_code, None)
+                self.search_index.remove(short_code)
+                if self.shared_table is not None:
+                    self.shared_table.remove(short_code)
+                for columns in (self.analytics, self.analytics_building):
+                    if columns is not None:
+                        columns.delete_link(short_code)
+                if save:
+                    self.save_urls()
+                
+                # Bloom filters can't remove entries; rebuild once enough have gone stale
+                self.filter_metrics['stale'] += 1
+                if self.filter_metrics['stale'] > self.code_filter.capacity * CODE_FILTER_STALE_RATIO:
+                    self.rebuild_code_filter()
+                self.archive.forget(short_code)
+                return True
+            return False
+    
+    def apply_batch(self, operations):
+        """Apply a list of shorten/delete operations with a single save.
+        
+        Each operation is a dict like {'op': 'shorten', 'url': ..., 'code': optional},
+        {'op': 'delete', 'code': ...} or {'op': 'set_destinations', 'code': ...,
+        'destinations': [{'url': ..., 'weight': ...}, ...]}. Returns one result
+        dict per operation.
+        """
+        results = []
+        changed = False
+        
+        # Reject malformed operations up front so they never reach the store
+        errors = [batch_operation_error(operation) for operation in operations]
+        
+        with self.lock:
+            try:
+                for operation, error in zip(operations, errors):
+                    if error is not None:
+                        results.append({'success': False, 'message': error})
+                        continue
+                    op = operation['op']
+                    
+                    if op == 'shorten':
+                        url = operation.get('url')
+                        if not url:
+                            results.append({'success': False, 'message': 'URL is required'})
+                            continue
+                        short_code = self.shorten(url, operation.get('code') or None, save=False)
+                        if short_code is None:
+                            results.append({'success': False, 'message': 'Short code is invalid or already taken'})
+                        else:
+                            results.append({'success': True, 'short_code': short_code, 'original_url': url})
+                            changed = True
+                    
+                    elif op == 'delete':
+                        if self.delete(operation.get('code') or '', save=False):
+                            results.append({'success': True})
+                            changed = True
+                        else:
+                            results.append({'success': False, 'message': 'Short code not found'})
+                    
+                    else:
+                        try:
+                            destinations = [(d['url'], d['weight']) for d in operation['destinations']]
+                            found = self.set_destinations(operation.get('code') or '', destinations, save=False)
+                        except (KeyError, TypeError, ValueError) as e:
+                            results.append({'success': False, 'message': f'Invalid destinations: {e}'})
+                            continue
+                        if found:
+                            results.append({'success': True})
+                            changed = True
+                        else:
+                            results.append({'success': False, 'message': 'Short code not found'})
+            finally:
+                # Persist what was applied even if an operation failed unexpectedly
+                if changed:
+                    self.save_urls()
+        return results
 
 
 shortener = URLShortener()
+namespaces = NamespaceManager(URLShortener)
+admission = AdmissionController()
 
 class URLShortenerHandler(BaseHTTPRequestHandler):
     def do_GET(self):
+        self.admit(self.handle_get)
+    
+    def do_POST(self):
+        self.admit(self.handle_post)
+    
+    def admit(self, handler):
+        """Run a request handler if the admission controller lets it in, else shed it"""
+        priority = request_priority(self.path)
+        started = admission.try_acquire(priority)
+        if started is None:
+            self.send_response(503)
+            self.send_header('Content-type', 'application/json')
+            self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(OVERLOADED_BODY)
+            return
+        try:
+            handler()
+        finally:
+            admission.release(started, priority)
+    
+    def handle_get(self):
         path = self.path
         
-        # Check if it's a redirect request (e.g., /r/happy-tiger)
+        # Check if it's a redirect request (e.g., /r/happy-tiger or /r/<namespace>/happy-tiger)
         if path.startswith('/r/'):
-            short_code = path[3:]  # Remove '/r/' prefix
-            user_agent = self.headers.get('User-Agent', 'Unknown')
-            
-            # Get user's IP address
-            # Check for X-Forwarded-For header first (for proxies), then use remote address
-            user_ip = self.headers.get('X-Forwarded-For', self.client_address[0])
-            if ',' in user_ip:
-                # If multiple IPs, take the first one
-                user_ip = user_ip.split(',')[0].strip()
-            
-            original_url = shortener.expand(short_code, user_agent, user_ip)
-            
-            if original_url:
-                # Check if it's a YouTube link
-                if 'youtube.com' in original_url or 'youtu.be' in original_url:
-                    # Show popup for YouTube links
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    
-                    html = f'''
-                    <!DOCTYPE html>
-                    <html>
-                    <head>
-                        <title>Redirecting...</title>
-                        <style>
-                            * {{
-                                margin: 0;
-                                padding: 0;
-                                box-sizing: border-box;
-                            }}
-                            body {{
-                                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                                background: #f0f0f0;
-                                display: flex;
-                                justify-content: center;
-                                align-items: center;
-                                min-height: 100vh;
-                            }}
-                            .overlay {{
-                                position: fixed;
-                                top: 0;
-                                left: 0;
-                                right: 0;
-                                bottom: 0;
-                                background: rgba(0, 0, 0, 0.5);
-                                display: flex;
-                                justify-content: center;
-                                align-items: center;
-                                z-index: 1000;
-                            }}
-                            .popup {{
-                                background: white;
-                                border-radius: 12px;
-                                box-shadow: 0 10px 40px rgba(0, 0, 0, 0.3);
-                                padding: 40px;
-                                text-align: center;
-                                min-width: 300px;
-                                animation: slideIn 0.3s ease-out;
-                            }}
-                            @keyframes slideIn {{
-                                from {{
-                                    transform: translateY(-20px);
-                                    opacity: 0;
-                                }}
-                                to {{
-                                    transform: translateY(0);
-                                    opacity: 1;
-                                }}
-                            }}
-                            .popup h2 {{
-                                color: #333;
-                                margin-bottom: 20px;
-                                font-size: 24px;
-                            }}
-                            .popup button {{
-                                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                                color: white;
-                                border: none;
-                                padding: 12px 30px;
-                                border-radius: 6px;
-                                font-size: 14px;
-                                font-weight: 600;
-                                cursor: pointer;
-                                transition: transform 0.2s, box-shadow 0.2s;
-                            }}
-                            .popup button:hover {{
-                                transform: translateY(-2px);
-                                box-shadow: 0 5px 20px rgba(102, 126, 234, 0.4);
-                            }}
-                        </style>
-                    </head>
-                    <body>
-                        <div class="overlay">
-                            <div class="popup">
-                                <h2>Please turn on your location as of the new Youtube Guidelines. <br> This is to ensure no person uses a VPN to hide their age and/or view restricted content.</h2>
-                                <button onclick="redirectToURL()">Okay</button>
-                            </div>
-                        </div>
-                        <script>
-                            function redirectToURL() {{
-                                window.location.href = '{original_url}';
-                            }}
-                        </script>
-                    </body>
-                    </html>
-                    '''
-                    self.wfile.write(html.encode())
-                else:
-                    # Direct redirect for non-YouTube links
-                    self.send_response(302)
-                    self.send_header('Location', original_url)
-                    self.end_headers()
+            parts = path[3:].split('/')
+            if len(parts) == 2:
+                store = namespaces.acquire(parts[0])
+                try:
+                    self.redirect(store, parts[1])
+                finally:
+                    if store is not None:
+                        namespaces.release(parts[0])
             else:
-                # Short code not found
-                self.send_response(404)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(b'<h1>404 - Short code not found</h1>')
+                self.redirect(shortener, path[3:])
+        
+        elif path.startswith('/api/'):
+            parsed = urlparse(path)
+            self.handle_api(parsed.path, parse_qs(parsed.query), read_only=True)
         
         elif path == '/':
             # Main page
@@ -369,58 +867,185 @@ class URLShortenerHandler(BaseHTTPRequestHandler):
             self.send_response(404)
             self.end_headers()
     
-    def do_POST(self):
+    def redirect(self, store, short_code):
+        """Redirect to the original URL of a short code in the given store"""
+        original_url = None
+        if store is not None:
+            original_url = store.expand(short_code, self.headers.get('User-Agent', 'Unknown'), client_ip(self))
+        
+        if original_url:
+            send_redirect(self, original_url)
+        else:
+            send_not_found(self)
+    
+    def handle_post(self):
+        content_length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(content_length).decode()
+        self.handle_api(self.path, parse_qs(body), body)
+    
+    def handle_api(self, path, data, body='', read_only=False):
+        """Dispatch an API request with its parsed form or query parameters"""
+        # Set once a namespace store is pinned, so it is released afterwards
+        namespace = None
         try:
-            if self.path == '/api/shorten':
-                content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length).decode()
-                data = parse_qs(body)
-                
+            # /api/<action> uses the default store, /api/<namespace>/<action> a namespaced one
+            parts = path[5:].split('/') if path.startswith('/api/') else []
+            
+            if read_only and parts[-1:] not in (['search'], ['available'], ['metrics'], ['analytics'], ['admission'], ['namespaces']):
+                self.send_response(405)
+                self.end_headers()
+                return
+            
+            if parts == ['namespaces']:
+                self.send_json(200, namespaces.get_metrics())
+                return
+            elif parts == ['admission']:
+                self.send_json(200, admission.get_metrics())
+                return
+            elif len(parts) == 1:
+                store = shortener
+                action = parts[0]
+                link_prefix = f"{PUBLIC_URL}/r"
+            elif len(parts) == 2:
+                action = parts[1]
+                store = namespaces.acquire(parts[0], create=(action in ('shorten', 'batch')))
+                if store is None:
+                    self.send_json(404, {'success': False, 'message': 'Namespace not found'})
+                    return
+                namespace = parts[0]
+                link_prefix = f"{PUBLIC_URL}/r/{namespace}"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            
+            if action == 'shorten':
                 url = data.get('url', [''])[0]
+                custom_code = data.get('code', [''])[0]
                 
                 if url:
-                    short_code = shortener.shorten(url)
-                    short_url = f"{PUBLIC_URL}/r/{short_code}"
+                    short_code = store.shorten(url, custom_code or None)
+                    if short_code is None:
+                        self.send_json(409, {'success': False, 'message': 'Short code is invalid or already taken'})
+                        return
+                    short_url = f"{link_prefix}/{short_code}"
                     
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({
+                    self.send_json(200, {
                         'success': True,
                         'short_code': short_code,
                         'short_url': short_url,
                         'original_url': url
-                    }).encode())
+                    })
                 else:
-                    self.send_response(400)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'success': False, 'message': 'URL is required'}).encode())
+                    self.send_json(400, {'success': False, 'message': 'URL is required'})
             
-            elif self.path == '/api/list':
-                urls = shortener.list_all()
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps(urls).encode())
+            elif action == 'list':
+                self.send_json(200, store.list_all())
+            
+            elif action == 'batch':
+                # Operations come as a JSON body, or a form field for simple clients;
+                # a JSON body is never read as a form, even if it parses as one
+                content_type = self.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+                if content_type == 'application/x-www-form-urlencoded':
+                    body = data.get('operations', [''])[0]
+                try:
+                    operations = json.loads(body)
+                except ValueError:
+                    operations = None
+                
+                if not isinstance(operations, list):
+                    self.send_json(400, {'success': False, 'message': 'Expected a JSON list of operations'})
+                elif len(operations) > MAX_BATCH_OPERATIONS:
+                    self.send_json(413, {'success': False, 'message': f'At most {MAX_BATCH_OPERATIONS} operations per batch'})
+                else:
+                    results = store.apply_batch(operations)
+                    for result in results:
+                        if 'short_code' in result:
+                            result['short_url'] = f"{link_prefix}/{result['short_code']}"
+                    self.send_json(200, {'success': True, 'results': results})
+            
+            elif action == 'destinations':
+                short_code = data.get('code', [''])[0]
+                urls = data.get('url', [])
+                weights = data.get('weight', [])
+                
+                try:
+                    if len(weights) != len(urls):
+                        raise ValueError("Expected one weight per url")
+                    found = store.set_destinations(short_code, list(zip(urls, map(float, weights))))
+                except ValueError as e:
+                    self.send_json(400, {'success': False, 'message': str(e)})
+                    return
+                
+                destinations = store.get_destinations(short_code) if found else None
+                if destinations is not None:
+                    self.send_json(200, {'success': True, 'short_code': short_code, 'destinations': destinations})
+                else:
+                    self.send_json(404, {'success': False, 'message': 'Short code not found'})
+            
+            elif action == 'search':
+                query = data.get('q', [''])[0]
+                domain = data.get('domain', [''])[0]
+                try:
+                    page = max(int(data.get('page', ['1'])[0]), 1)
+                    per_page = min(max(int(data.get('per_page', ['20'])[0]), 1), 100)
+                except ValueError:
+                    self.send_json(400, {'success': False, 'message': 'page and per_page must be integers'})
+                    return
+                
+                total, results = store.search(query, domain, (page - 1) * per_page, per_page)
+                self.send_json(200, {
+                    'success': True,
+                    'total': total,
+                    'page': page,
+                    'per_page': per_page,
+                    'results': results
+                })
             
-            elif self.path == '/api/delete':
-                content_length = int(self.headers.get('Content-Length', 0))
-                body = self.rfile.read(content_length).decode()
-                data = parse_qs(body)
+            elif action == 'snapshot':
+                name = take_snapshot(store)
+                if name is None:
+                    self.send_json(409, {'success': False, 'message': 'A snapshot is already in progress'})
+                else:
+                    self.send_json(202, {'success': True, 'snapshot': name})
+            
+            elif action == 'snapshots':
+                self.send_json(200, {'success': True, 'snapshots': list_snapshots(store.filename)})
+            
+            elif action == 'analytics':
+                bucket = data.get('bucket', [''])[0]
+                if bucket.isdigit():
+                    bucket = int(bucket)
+                group_by = [dimension for dimension in data.get('group_by', [''])[0].split(',') if dimension]
+                filters = {dimension: data[dimension] for dimension in DIMENSIONS if dimension in data}
                 
+                try:
+                    rows = store.get_analytics().query(
+                        data.get('since', [''])[0] or None,
+                        data.get('until', [''])[0] or None,
+                        bucket or None,
+                        group_by,
+                        filters
+                    )
+                except (KeyError, TypeError, ValueError) as e:
+                    self.send_json(400, {'success': False, 'message': f'Invalid query: {e}'})
+                    return
+                self.send_json(200, {'success': True, 'rows': rows})
+            
+            elif action == 'metrics':
+                self.send_json(200, store.get_metrics())
+            
+            elif action == 'available':
+                short_code = data.get('code', [''])[0]
+                self.send_json(200, {'success': True, 'code': short_code, 'available': store.is_code_available(short_code)})
+            
+            elif action == 'delete':
                 short_code = data.get('code', [''])[0]
                 
-                if shortener.delete(short_code):
-                    self.send_response(200)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'success': True}).encode())
+                if store.delete(short_code):
+                    self.send_json(200, {'success': True})
                 else:
-                    self.send_response(404)
-                    self.send_header('Content-type', 'application/json')
-                    self.end_headers()
-                    self.wfile.write(json.dumps({'success': False, 'message': 'Short code not found'}).encode())
+                    self.send_json(404, {'success': False, 'message': 'Short code not found'})
             
             else:
                 self.send_response(404)
@@ -428,14 +1053,73 @@ class URLShortenerHandler(BaseHTTPRequestHandler):
         
         except Exception as e:
             print(f"[ERROR] {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'success': False, 'message': 'Internal server error'}).encode())
+            self.send_json(500, {'success': False, 'message': 'Internal server error'})
+        finally:
+            if namespace is not None:
+                namespaces.release(namespace)
+    
+    def send_json(self, status, payload):
+        """Send a JSON response"""
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps(payload).encode())
     
     def log_message(self, format, *args):
         pass  # Suppress logging
 
+class InternalHandler(URLShortenerHandler):
+    """Handler for the loopback listener that redirect workers talk to.
+    
+    Serves everything the public handler does, for the requests workers
+    forward, plus POST /internal/clicks where workers report the clicks
+    they redirected: a JSON list of {'namespace', 'code', 'timestamp',
+    'user_agent', 'ip', 'destination'} objects.
+    """
+    
+    def handle_post(self):
+        if self.path != '/internal/clicks':
+            super().handle_post()
+            return
+        
+        content_length = int(self.headers.get('Content-Length', 0))
+        try:
+            clicks = json.loads(self.rfile.read(content_length).decode())
+        except ValueError:
+            self.send_json(400, {'success': False, 'message': 'Invalid JSON'})
+            return
+        
+        by_namespace = {}
+        for click in clicks:
+            by_namespace.setdefault(click.get('namespace'), []).append(click)
+        
+        recorded = 0
+        locations = {}
+        for namespace, group in by_namespace.items():
+            store = shortener if namespace is None else namespaces.acquire(namespace)
+            if store is None:
+                continue
+            try:
+                for click in group:
+                    # One lookup per IP per report rather than per click
+                    if click['ip'] not in locations:
+                        locations[click['ip']] = get_geolocation(click['ip'])
+                    record = store.click_record(click['user_agent'], click['ip'], locations[click['ip']],
+                                                click['timestamp'])
+                    if store.record_click(click['code'], record, click.get('destination'), save=False):
+                        recorded += 1
+                store.save_urls()
+            finally:
+                if namespace is not None:
+                    namespaces.release(namespace)
+        self.send_json(200, {'success': True, 'recorded': recorded})
+
+class ShortenerHTTPServer(ThreadingHTTPServer):
+    # Queue bursts in the kernel and let the admission controller shed them,
+    # instead of dropping SYNs and making clients wait out a TCP retry
+    request_queue_size = 128
+    daemon_threads = True
+
 html_content = '''
 <!DOCTYPE html>
 <html>
@@ -868,7 +1552,7 @@ def main():
     global PUBLIC_URL
     
     try:
-        server = HTTPServer(('0.0.0.0', SERVER_PORT), URLShortenerHandler)
+        server = ShortenerHTTPServer(('0.0.0.0', SERVER_PORT), URLShortenerHandler)
     except Exception as e:
         print(f"[ERROR] Failed to bind server: {e}")
         return
@@ -883,6 +1567,7 @@ def main():
     print(f"Network access:      http://{LOCAL_IP}:{SERVER_PORT}")
     print(f"Public URL for links: {PUBLIC_URL}")
     print(f"Mappings stored in:  {URLS_FILE}")
+    print(f"Namespaces in:       {NAMESPACES_DIR}/ (/r/<namespace>/<code>, /api/<namespace>/...)")
     print("=" * 70)
     print("\nSHARING LINKS:")
     print(f"   Share this URL with anyone: {PUBLIC_URL}")
@@ -895,6 +1580,16 @@ def main():
     print("   set SHORTENER_PUBLIC_URL=http://your-public-ip:8001")
     print("=" * 70 + "\n")
     
+    start_snapshot_schedule(shortener)
+    
+    workers = []
+    if REDIRECT_WORKERS > 0:
+        internal = ShortenerHTTPServer(('127.0.0.1', 0), InternalHandler)
+        threading.Thread(target=internal.serve_forever, daemon=True).start()
+        workers = start_redirect_workers(server.socket, internal.server_address[1], REDIRECT_WORKERS,
+                                         shared_table_path_for(URLS_FILE), NAMESPACES_DIR)
+        print(f"Redirect workers:    {len(workers)}\n")
+    
     # Don't open browser in server environment
     # webbrowser.open(f'http://localhost:{SERVER_PORT}')
     
@@ -902,6 +1597,12 @@ def main():
         server.serve_forever()
     except KeyboardInterrupt:
         print("\nServer shutting down...")
+        # Workers report their last clicks while the internal listener still runs
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+        namespaces.flush_all()
     except Exception as e:
         print(f"[ERROR] Server error: {e}")
 